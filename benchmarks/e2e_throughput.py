@@ -0,0 +1,178 @@
+"""
+End-to-end throughput benchmark against the Firebase emulators.
+
+Seeds synthetic shipments and orders, applies rounds of shipment updates, drives
+order_status_update_producer (and order_status_update_batch_consumer in batch mode) and waits
+until the ERP mock has caught up. Reports ERP pushes/sec, p50/p95/p99 lag from shipment
+`last_updated` to ERP order `updated_at`, and the number of duplicate updates the ERP received.
+
+The emulators must be running with the auth token seeded (functions/auth/scripts/seed_auth_token.py):
+    firebase emulators:start --only functions,firestore,pubsub
+    python benchmarks/e2e_throughput.py --shipments 5000 --update-rate 0.5 --rounds 3 \\
+        --duplicate-rate 0.1 --out-of-order-rate 0.05
+
+In push mode the functions emulator runs the consumer for each message. In batch mode the
+consumers' CONSUMER_MODE must be "batch" and the benchmark runs the batch consumer itself.
+With --ingestion webhook the updates are delivered as signed webhooks to receive_shipment_updates
+instead of being polled. The producer's WEBHOOK_SECRET must match --webhook-secret.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import load_generator  # noqa: E402
+from google.cloud import firestore_v1  # noqa: E402
+from google.cloud.firestore_v1.base_query import FieldFilter  # noqa: E402
+from load_generator import PROJECT_ID, ROOT  # noqa: E402
+
+FUNCTIONS_EMULATOR = os.environ.get("FUNCTIONS_EMULATOR_ORIGIN", "http://127.0.0.1:5001")
+
+
+def function_url(region: str, name: str) -> str:
+    return f"{FUNCTIONS_EMULATOR}/{PROJECT_ID}/{region}/{name}"
+
+
+def run_function(codebase: str, function_name: str, env: dict) -> None:
+    """
+    Runs a scheduled function once in its own interpreter, the way the scheduler would.
+    Each codebase has its own `main` module, so they cannot share a process.
+    """
+    code = f"import main; main.{function_name}.__wrapped__(None)"
+    subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.join(ROOT, "functions", codebase),
+        env={**os.environ, **env},
+        check=True,
+    )
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))]
+
+
+def wait_for_orders(
+    db: firestore_v1.Client, expected: dict[str, str], timeout: float, between_polls: Callable[[], None]
+) -> dict[str, dict]:
+    """Polls the ERP orders until every order carries its expected shipment version, or the timeout passes."""
+    deadline = time.monotonic() + timeout
+    orders = {}
+    pending = dict(expected)
+    while pending and time.monotonic() < deadline:
+        refs = [db.collection("orders").document(order_id) for order_id in pending]
+        for start in range(0, len(refs), 500):
+            for doc in db.get_all(refs[start:start + 500]):
+                order = doc.to_dict()
+                if order and order["shipment"]["last_updated"] >= pending[doc.id]:
+                    orders[doc.id] = order
+        pending = {order_id: version for order_id, version in pending.items() if order_id not in orders}
+        if pending:
+            print(f"Waiting for {len(pending)} orders...")
+            between_polls()
+    return orders
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--shipments", type=int, default=5000)
+    arg_parser.add_argument("--update-rate", type=float, default=0.5, help="Fraction of shipments updated per round")
+    arg_parser.add_argument("--rounds", type=int, default=3)
+    arg_parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    arg_parser.add_argument("--out-of-order-rate", type=float, default=0.0)
+    arg_parser.add_argument("--consumer", choices=["push", "batch"], default="push")
+    arg_parser.add_argument("--ingestion", choices=["poll", "webhook"], default="poll")
+    arg_parser.add_argument("--webhook-secret", default=os.environ.get("WEBHOOK_SECRET", ""))
+    arg_parser.add_argument("--ops-per-second", type=int, default=20000)
+    arg_parser.add_argument("--timeout", type=float, default=600)
+    arg_parser.add_argument("--seed", type=int, default=42)
+    arg_parser.add_argument("--skip-seed", action="store_true")
+    args = arg_parser.parse_args()
+
+    random.seed(args.seed)
+    db = firestore_v1.Client()
+    shipments, orders = load_generator.make_dataset(args.shipments, datetime(2026, 1, 1, tzinfo=timezone.utc))
+    if not args.skip_seed:
+        load_generator.seed(db, shipments, orders, args.ops_per_second)
+
+    env = {
+        "GCLOUD_PROJECT": PROJECT_ID,
+        "LOGISTICS_API_BASE_URL": function_url("africa-south1", "get_shipments"),
+        "LOGISTICS_AUTH_API_URL": function_url("africa-south1", "authenticate"),
+        "ERP_API_BASE_URL": function_url("africa-south1", "update_shipment"),
+        "ERP_BATCH_API_URL": function_url("africa-south1", "update_shipments"),
+        "CONSUMER_MODE": args.consumer,
+    }
+
+    if args.consumer == "batch":
+        # The pull subscription only receives messages published after it exists
+        load_generator.ensure_topic()
+        run_function("consumer", "order_status_update_batch_consumer", env)
+
+    started_at = datetime.now(timezone.utc)
+    started = time.monotonic()
+    expected = {}
+    duplicates = out_of_order = 0
+    for round_number in range(1, args.rounds + 1):
+        updated = load_generator.apply_update_round(db, shipments, args.update_rate, args.ops_per_second)
+        expected.update({current["order_id"]: current["last_updated"] for _, current in updated})
+        print(f"Round {round_number}: updated {len(updated)} shipments")
+
+        if args.ingestion == "webhook":
+            load_generator.send_webhooks(
+                [current for _, current in updated],
+                function_url("europe-west3", "receive_shipment_updates"),
+                args.webhook_secret,
+            )
+        else:
+            run_function("producer", "order_status_update_producer", env)
+        injected = load_generator.inject_deliveries(updated, args.duplicate_rate, args.out_of_order_rate)
+        duplicates += injected[0]
+        out_of_order += injected[1]
+        if args.consumer == "batch":
+            run_function("consumer", "order_status_update_batch_consumer", env)
+
+    if args.consumer == "batch":
+        def between_polls():
+            run_function("consumer", "order_status_update_batch_consumer", env)
+    else:
+        def between_polls():
+            time.sleep(2)
+    converged = wait_for_orders(db, expected, args.timeout, between_polls)
+    elapsed = time.monotonic() - started
+
+    lags = [
+        (datetime.fromisoformat(order["updated_at"]) - datetime.fromisoformat(order["shipment"]["last_updated"]))
+        .total_seconds()
+        for order in converged.values()
+    ]
+    pushes = sum(
+        1
+        for doc in db.collection("order-status-updates")
+        .where(filter=FieldFilter("processed_at", ">=", started_at))
+        .stream()
+        if doc.get("status") == "COMPLETED"
+    )
+    # The ERP mock counts updates for a version it already holds
+    duplicates_received = sum(order.get("duplicate_updates", 0) for order in converged.values())
+
+    print()
+    print(f"Shipments updated:     {len(expected)} over {args.rounds} rounds")
+    print(f"Injected:              {duplicates} duplicates, {out_of_order} out-of-order")
+    print(f"Orders converged:      {len(converged)} / {len(expected)} in {elapsed:.1f}s")
+    print(f"ERP pushes:            {pushes} ({pushes / elapsed:.1f} msg/s)")
+    p50, p95, p99 = (percentile(lags, percent) for percent in (50, 95, 99))
+    print(f"Lag p50 / p95 / p99:   {p50:.2f}s / {p95:.2f}s / {p99:.2f}s")
+    print(f"Duplicate ERP updates: {duplicates_received}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Synthetic load for the Firebase emulators.
+
+Generates shipments in the external mock and matching orders in the ERP mock, then applies
+rounds of shipment updates. Duplicate and out-of-order deliveries are injected straight into
+the shipment queue in the producer's message format, the way Pub/Sub redelivery and late
+retries would produce them.
+
+Usage (seed only):
+    export FIRESTORE_EMULATOR_HOST=localhost:8080 PUBSUB_EMULATOR_HOST=localhost:8085
+    python benchmarks/load_generator.py --shipments 100000 --ops-per-second 20000
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("FIRESTORE_EMULATOR_HOST", "localhost:8080")
+os.environ.setdefault("PUBSUB_EMULATOR_HOST", "localhost:8085")
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "yoco-logistics-intergration")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "functions", "mocks", "scripts"))
+sys.path.insert(0, os.path.join(ROOT, "functions", "mocks", "external", "scripts"))
+
+import requests  # noqa: E402
+from bulk_loader import bulk_load  # noqa: E402
+from google.api_core.exceptions import AlreadyExists  # noqa: E402
+from google.cloud import firestore_v1, pubsub_v1  # noqa: E402
+from seed_shipments import with_native_timestamp  # noqa: E402
+
+PROJECT_ID = os.environ["GOOGLE_CLOUD_PROJECT"]
+TOPIC_ID = "erp-order-status-update-queue"
+STATUSES = ["pending", "transit", "out_for_delivery", "delivered"]
+CITIES = ["New York, NY", "Los Angeles, CA", "Chicago, IL", "Miami, FL", "Seattle, WA", "Austin, TX"]
+
+
+def to_iso(value: datetime) -> str:
+    return value.isoformat().replace("+00:00", "Z")
+
+
+def make_dataset(count: int, start: datetime) -> tuple[list[dict], list[dict]]:
+    """Returns shipments and their matching orders, with every order in sync with its shipment."""
+    shipments, orders = [], []
+    for i in range(count):
+        created_at = to_iso(start + timedelta(milliseconds=i))
+        shipment = {
+            "id": str(uuid.uuid4()),
+            "order_id": str(uuid.uuid4()),
+            "reference": f"SHIP-{i:07d}",
+            "origin": random.choice(CITIES),
+            "destination": random.choice(CITIES),
+            "status": STATUSES[0],
+            "last_updated": created_at,
+            "updated_at": created_at,
+            "created_at": created_at,
+        }
+        shipments.append(shipment)
+        orders.append(
+            {
+                "id": shipment["order_id"],
+                "status": shipment["status"],
+                "shipment": dict(shipment),
+                "created_at": created_at,
+                "updated_at": created_at,
+            }
+        )
+    return shipments, orders
+
+
+def seed(db: firestore_v1.Client, shipments: list[dict], orders: list[dict], ops_per_second: int) -> None:
+    bulk_load(db, "orders", orders, ops_per_second=ops_per_second)
+    bulk_load(db, "shipments", shipments, with_native_timestamp, ops_per_second)
+
+
+def apply_update_round(
+    db: firestore_v1.Client, shipments: list[dict], update_rate: float, ops_per_second: int
+) -> list[tuple[dict, dict]]:
+    """
+    Moves a fraction of the shipments to their next status with last_updated set to now.
+    Returns (previous, current) versions of every updated shipment and updates `shipments` in place.
+    """
+    updated = []
+    for index in random.sample(range(len(shipments)), round(len(shipments) * update_rate)):
+        previous = shipments[index]
+        now = to_iso(datetime.now(timezone.utc))
+        status = STATUSES[min(STATUSES.index(previous["status"]) + 1, len(STATUSES) - 1)]
+        shipments[index] = {**previous, "status": status, "last_updated": now, "updated_at": now}
+        updated.append((previous, shipments[index]))
+
+    bulk_load(db, "shipments", [current for _, current in updated], with_native_timestamp, ops_per_second)
+    return updated
+
+
+def inject_deliveries(
+    updated: list[tuple[dict, dict]], duplicate_rate: float, out_of_order_rate: float
+) -> tuple[int, int]:
+    """
+    Publishes duplicates of the current versions and late copies of the previous versions.
+    Returns the number of duplicates and out-of-order messages published.
+    """
+    publisher = pubsub_v1.PublisherClient()
+    topic = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+    futures = []
+    duplicates = out_of_order = 0
+    for previous, current in updated:
+        if random.random() < duplicate_rate:
+            futures.append(publish_shipment(publisher, topic, current))
+            duplicates += 1
+        if random.random() < out_of_order_rate:
+            futures.append(publish_shipment(publisher, topic, previous))
+            out_of_order += 1
+    for future in futures:
+        future.result()
+    return duplicates, out_of_order
+
+
+def ensure_topic() -> None:
+    publisher = pubsub_v1.PublisherClient()
+    try:
+        publisher.create_topic(request={"name": publisher.topic_path(PROJECT_ID, TOPIC_ID)})
+    except AlreadyExists:
+        pass
+
+
+def publish_shipment(publisher: pubsub_v1.PublisherClient, topic: str, shipment: dict):
+    return publisher.publish(
+        topic,
+        json.dumps(shipment).encode("utf-8"),
+        shipment_id=shipment["id"],
+        updated_at=datetime.now(timezone.utc).isoformat(),
+    )
+
+
+def send_webhooks(shipments: list[dict], url: str, secret: str, batch_size: int = 100) -> None:
+    """Delivers shipment updates to receive_shipment_updates as signed webhooks of `batch_size` updates."""
+    session = requests.Session()
+    for start in range(0, len(shipments), batch_size):
+        body = json.dumps({"shipments": shipments[start:start + batch_size]}).encode()
+        timestamp = str(int(time.time()))
+        digest = hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+        response = session.post(
+            url,
+            data=body,
+            headers={
+                "Content-Type": "application/json",
+                "X-Webhook-Timestamp": timestamp,
+                "X-Webhook-Signature": f"sha256={digest}",
+            },
+            timeout=30,
+        )
+        response.raise_for_status()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--shipments", type=int, default=10000)
+    arg_parser.add_argument("--ops-per-second", type=int, default=20000)
+    arg_parser.add_argument("--seed", type=int, default=42)
+    args = arg_parser.parse_args()
+
+    random.seed(args.seed)
+    shipments, orders = make_dataset(args.shipments, datetime(2026, 1, 1, tzinfo=timezone.utc))
+    seed(firestore_v1.Client(), shipments, orders, args.ops_per_second)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Micro-benchmark for the shipment queue message encodings on the seeded shipment payloads.
+
+Compares the original `json.dumps` payload with the codec module's compact JSON and msgpack
+`shipment.v1` encodings: bytes per message and encode/decode time. Gzip is also forced on every
+message to show why the codec only compresses payloads over COMPRESSION_THRESHOLD_BYTES.
+
+Usage:
+    python benchmarks/message_encoding.py --shipments 10000
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "functions", "producer"))
+
+import codec  # noqa: E402
+
+
+def load_shipments(count: int) -> list[dict]:
+    """Shipments sampled from the seed data, with the updated_at the producer adds."""
+    with open(os.path.join(ROOT, "functions", "mocks", "external", "scripts", "db.json")) as f:
+        seeds = json.load(f)["shipments"]
+
+    random.seed(42)
+    shipments = []
+    for i in range(count):
+        shipment = dict(random.choice(seeds))
+        shipment["id"] = f"{shipment['id']}-{i}"
+        shipment.setdefault("updated_at", "2026-01-01T00:00:00.000000+00:00")
+        shipments.append(shipment)
+    return shipments
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--shipments", type=int, default=10000)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    shipments = load_shipments(args.shipments)
+
+    def encode_original(shipment):
+        return json.dumps(shipment).encode("utf-8"), {}
+
+    def encode_gzip(encoding):
+        def encode(shipment):
+            data, attributes = codec.encode_shipment(shipment, encoding)
+            if "content_encoding" not in attributes:
+                data = gzip.compress(data, compresslevel=6)
+                attributes["content_encoding"] = codec.GZIP
+            return data, attributes
+        return encode
+
+    encoders = {
+        "json (original)": encode_original,
+        "json (compact)": lambda shipment: codec.encode_shipment(shipment, "json"),
+        "msgpack": lambda shipment: codec.encode_shipment(shipment, "msgpack"),
+        "json + gzip": encode_gzip("json"),
+        "msgpack + gzip": encode_gzip("msgpack"),
+    }
+
+    print(f"{len(shipments)} shipment messages")
+    print(f"{'encoding':>16}  {'bytes/msg':>9}  {'total KiB':>9}  {'encode ms':>9}  {'decode ms':>9}")
+    baseline = None
+    for name, encode in encoders.items():
+        messages = [encode(shipment) for shipment in shipments]
+        for shipment, (data, attributes) in zip(shipments, messages):
+            assert codec.decode_shipment(data, attributes) == shipment, name
+
+        size = sum(len(data) for data, _ in messages)
+        baseline = baseline or size
+        encode_time = min(
+            timeit.repeat(lambda: [encode(shipment) for shipment in shipments], number=1, repeat=args.repeat)
+        )
+        decode_time = min(
+            timeit.repeat(
+                lambda: [codec.decode_shipment(data, attributes) for data, attributes in messages],
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(
+            f"{name:>16}  {size / len(messages):9.1f}  {size / 1024:9.1f}  "
+            f"{encode_time * 1000:9.1f}  {decode_time * 1000:9.1f}  {size / baseline:5.2f}x size"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Micro-benchmark for parse_date on realistic shipment payloads.
+
+Compares the old dateutil-only implementation with the shared dates module on timestamps
+shaped like the seeded shipments, repeated the way the producer sees them: every shipment
+in a page is parsed when the page is sorted and again when its messages are generated.
+
+Usage:
+    python benchmarks/parse_date.py --shipments 10000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from dateutil import parser
+from dateutil.tz import tzutc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "functions", "producer"))
+
+import dates  # noqa: E402
+
+
+def parse_date_dateutil(value) -> datetime:
+    if not isinstance(value, (str, datetime)):
+        raise TypeError('parse_date() first argument must be either type str or datetime')
+    if isinstance(value, str):
+        value = parser.parse(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=tzutc())
+    return value
+
+
+def load_timestamps(count: int) -> list[str]:
+    """Timestamps in the formats the seeded shipments use, spread out like a real backlog."""
+    with open(os.path.join(ROOT, "functions", "mocks", "external", "scripts", "db.json")) as f:
+        shipments = json.load(f)["shipments"]
+    seeds = [parser.parse(shipment["last_updated"]) for shipment in shipments]
+
+    random.seed(42)
+    timestamps = []
+    for i in range(count):
+        value = random.choice(seeds) + timedelta(seconds=random.randint(0, 30 * 24 * 3600))
+        # Mostly "Z" suffixed like the seed data, some with an explicit offset and fractions like the producer writes
+        if i % 4:
+            timestamps.append(value.strftime("%Y-%m-%dT%H:%M:%SZ"))
+        else:
+            timestamps.append(value.isoformat(timespec="microseconds"))
+    return timestamps
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--shipments", type=int, default=10000)
+    arg_parser.add_argument("--page-size", type=int, default=500)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    timestamps = load_timestamps(args.shipments)
+    workload = []
+    for start in range(0, len(timestamps), args.page_size):
+        page = timestamps[start:start + args.page_size]
+        workload.extend(page * 2)
+
+    for value in timestamps:
+        assert dates.parse_date(value) == parse_date_dateutil(value), value
+
+    def run_dateutil():
+        for value in workload:
+            parse_date_dateutil(value)
+
+    def run_cold():
+        dates._parse_str.cache_clear()
+        for value in timestamps:
+            dates.parse_date(value)
+
+    def run_memoised():
+        dates._parse_str.cache_clear()
+        for value in workload:
+            dates.parse_date(value)
+
+    baseline = min(timeit.repeat(run_dateutil, number=1, repeat=args.repeat))
+    print(f"{len(workload)} parses of {len(timestamps)} shipment timestamps")
+    print(f"{'dateutil':>22}: {baseline * 1000:8.1f} ms")
+    # The cold run parses each timestamp once, so scale it to the same number of parses
+    cold = min(timeit.repeat(run_cold, number=1, repeat=args.repeat)) * 2
+    print(f"{'fromisoformat, no memo':>22}: {cold * 1000:8.1f} ms  {baseline / cold:6.1f}x")
+    memoised = min(timeit.repeat(run_memoised, number=1, repeat=args.repeat))
+    print(f"{'fromisoformat + memo':>22}: {memoised * 1000:8.1f} ms  {baseline / memoised:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
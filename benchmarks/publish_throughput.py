@@ -0,0 +1,118 @@
+"""
+Publish throughput benchmark for the producer, run against the Pub/Sub emulator.
+
+Publishes the same synthetic backlog twice: once the way the producer used to (default
+PublisherClient) and once through the producer's tuned publisher (BatchSettings, flow control
+and, with PUBSUB_ORDERING_KEY_BUCKETS > 0, ordering keys). Reports messages/sec and the number
+of publish RPCs for each.
+
+Usage:
+    firebase emulators:start --only pubsub
+    python benchmarks/publish_throughput.py --messages 50000
+
+Recorded figures, 20,000 messages on one CPU against a local Publish endpoint with no server
+latency, so msg/s is bound by client CPU (the tuned run also coalesces and encodes each page):
+
+    buckets  latency   baseline msg/s  RPCs    tuned msg/s  RPCs
+    0        50 ms     7,900-8,200     279-284   7,615-7,641  35-37
+    4        50 ms     8,023           283       7,148        128
+    16       50 ms     8,034           280       5,040        608
+    16       200 ms    8,907           281       7,587        128
+
+Unordered publishing (the default) sends about 8x fewer requests, within 5% of the throughput.
+Ordering keys split batches per key, so each bucket adds requests and costs throughput.
+Emulator figures are still to be recorded.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("PUBSUB_EMULATOR_HOST", "localhost:8085")
+os.environ.setdefault("GCLOUD_PROJECT", "yoco-logistics-intergration")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "functions", "producer"))
+
+import main as producer  # noqa: E402
+from google.cloud import pubsub_v1  # noqa: E402
+
+STATUSES = ["pending", "transit", "delivered"]
+
+
+def make_shipments(count: int) -> list[dict]:
+    start = datetime(2026, 2, 6, 10, 0, tzinfo=timezone.utc)
+    shipments = []
+    for i in range(count):
+        last_updated = (start + timedelta(seconds=i)).isoformat().replace("+00:00", "Z")
+        shipments.append(
+            {
+                "id": str(uuid.uuid4()),
+                "order_id": str(uuid.uuid4()),
+                "reference": f"SHIP-{i:07d}",
+                "origin": "New York, NY",
+                "destination": "Los Angeles, CA",
+                "status": STATUSES[i % len(STATUSES)],
+                "last_updated": last_updated,
+                "updated_at": last_updated,
+                "created_at": last_updated,
+            }
+        )
+    return shipments
+
+
+def count_publish_rpcs(publisher: pubsub_v1.PublisherClient) -> list[int]:
+    """Wraps the client's publish RPC so the benchmark can count the requests it sends."""
+    calls = [0]
+    gapic_publish = publisher._gapic_publish
+
+    def counted(*args, **kwargs):
+        calls[0] += 1
+        return gapic_publish(*args, **kwargs)
+
+    publisher._gapic_publish = counted
+    return calls
+
+
+def publish_baseline(shipments: list[dict]) -> tuple[float, int]:
+    publisher = pubsub_v1.PublisherClient()
+    calls = count_publish_rpcs(publisher)
+    topic = publisher.topic_path(producer.PROJECT_ID, producer.TOPIC_ID)
+
+    started = time.perf_counter()
+    futures = [
+        publisher.publish(topic, json.dumps(shipment).encode("utf-8"), shipment_id=shipment["id"])
+        for shipment in shipments
+    ]
+    for future in futures:
+        future.result()
+    return time.perf_counter() - started, calls[0]
+
+
+def publish_tuned(shipments: list[dict]) -> tuple[float, int]:
+    publisher = producer.create_publisher()
+    calls = count_publish_rpcs(publisher)
+
+    started = time.perf_counter()
+    for future, _, _ in producer.generate_shipment_messages(publisher, shipments):
+        future.result()
+    return time.perf_counter() - started, calls[0]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--messages", type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    shipments = make_shipments(args.messages)
+    producer.ensure_topic_exists(pubsub_v1.PublisherClient(), producer.PROJECT_ID, producer.TOPIC_ID)
+
+    print(f"Publishing {args.messages} messages to {os.environ['PUBSUB_EMULATOR_HOST']}")
+    for name, publish in (("baseline", publish_baseline), ("tuned", publish_tuned)):
+        elapsed, rpcs = publish(shipments)
+        print(f"{name:>8}: {args.messages / elapsed:10.0f} msg/s  {rpcs:6d} publish RPCs  {elapsed:7.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Cold start benchmark for every function codebase.
+
+Each sample is a fresh interpreter that imports the codebase's main module, as a new instance
+does, then runs the setup the function's first invocation pays for before its first network
+call: the clients it creates and the libraries they import. Clients point at the emulator hosts,
+so nothing leaves the machine and no emulator needs to be running.
+
+With --baseline the same functions are measured on a git ref, so a change can be compared with
+the code before it.
+
+Usage:
+    python benchmarks/startup.py --samples 5
+    python benchmarks/startup.py --samples 5 --baseline HEAD~1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Statements run in the main module's namespace, mirroring what each function's first call sets up
+FIRST_CALLS = {
+    "producer": {
+        "order_status_update_producer": "get_firestore_client(); get_publisher(); get_http_session()",
+        "order_status_update_shard_producer": "get_firestore_client(); get_publisher(); get_http_session()",
+        "receive_shipment_updates": "get_publisher()",
+    },
+    "consumer": {
+        "order_status_update_consumer": "get_firestore_client(); get_http_session()",
+        "order_status_update_batch_consumer": "get_firestore_client(); get_subscriber(); get_http_session()",
+        "order_status_update_lock_sweeper": "get_firestore_client()",
+        "order_status_update_ledger_compactor": "get_firestore_client()",
+    },
+    "auth": {
+        "authenticate": "import base64; get_firestore_client(); get_fernet(base64.urlsafe_b64encode(bytes(32)))",
+    },
+    "mocks/erp": {
+        "update_shipment": "get_firestore_client()",
+        "update_shipments": "get_firestore_client()",
+    },
+    "mocks/external": {
+        "get_shipments": "get_firestore_client()",
+    },
+}
+HEAVY_MODULES = ("google.cloud.firestore_v1", "google.cloud.pubsub_v1", "grpc", "httpx", "cryptography")
+
+SAMPLE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+loaded = [name for name in {heavy!r} if name in sys.modules]
+exec({first_call!r}, vars(main))
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "first_call_ms": (time.perf_counter() - imported) * 1000,
+    "loaded": loaded,
+}}))
+"""
+
+
+def load_env(codebase_dir: str) -> dict:
+    env = dict(os.environ)
+    path = os.path.join(codebase_dir, ".env.example")
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#") and "=" in line:
+                    key, value = line.split("=", 1)
+                    env.setdefault(key, value.strip('"'))
+    env.setdefault("FIRESTORE_EMULATOR_HOST", "localhost:8080")
+    env.setdefault("PUBSUB_EMULATOR_HOST", "localhost:8085")
+    env.setdefault("GCLOUD_PROJECT", "yoco-logistics-intergration")
+    env.setdefault("GOOGLE_CLOUD_PROJECT", env["GCLOUD_PROJECT"])
+    return env
+
+
+def sample(codebase_dir: str, env: dict, first_call: str) -> dict:
+    script = SAMPLE.format(heavy=HEAVY_MODULES, first_call=first_call)
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=codebase_dir, env=env, capture_output=True, text=True, check=True
+    )
+    # Telemetry log lines come first
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(functions_dir: str, samples: int) -> dict[tuple[str, str], dict]:
+    results = {}
+    for codebase, first_calls in FIRST_CALLS.items():
+        codebase_dir = os.path.join(functions_dir, codebase)
+        env = load_env(codebase_dir)
+        # Untimed run, so every sample imports from compiled bytecode like a deployed instance
+        sample(codebase_dir, env, "pass")
+        for function, first_call in first_calls.items():
+            runs = [sample(codebase_dir, env, first_call) for _ in range(samples)]
+            results[codebase, function] = {
+                "import_ms": statistics.median(run["import_ms"] for run in runs),
+                "first_call_ms": statistics.median(run["first_call_ms"] for run in runs),
+                "loaded": runs[0]["loaded"],
+            }
+    return results
+
+
+def extract(ref: str, target: str) -> str:
+    """Writes the functions directory at `ref` into `target` and returns its path."""
+    archive = os.path.join(target, "functions.tar")
+    subprocess.run(["git", "archive", "-o", archive, ref, "functions"], cwd=ROOT, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(target, filter="data")
+    return os.path.join(target, "functions")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--samples", type=int, default=5)
+    arg_parser.add_argument("--baseline", help="git ref to compare against, e.g. HEAD~1")
+    args = arg_parser.parse_args()
+
+    after = measure(os.path.join(ROOT, "functions"), args.samples)
+    before = None
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as target:
+            before = measure(extract(args.baseline, target), args.samples)
+
+    print(f"Median of {args.samples} fresh interpreters per function (ms)")
+    header = f"{'function':>44}  {'import':>7}  {'1st call':>8}  {'cold':>7}"
+    if before:
+        header += f"  {'before':>7}  {'change':>7}"
+    print(header)
+    for (codebase, function), result in after.items():
+        cold = result["import_ms"] + result["first_call_ms"]
+        name = f"{codebase}/{function}"
+        line = f"{name:>44}  {result['import_ms']:7.0f}  {result['first_call_ms']:8.0f}  {cold:7.0f}"
+        if before and (codebase, function) in before:
+            previous = before[codebase, function]
+            before_cold = previous["import_ms"] + previous["first_call_ms"]
+            line += f"  {before_cold:7.0f}  {(cold - before_cold) / before_cold:+7.0%}"
+        print(line)
+
+    print("\nLoaded at import:")
+    for codebase in FIRST_CALLS:
+        loaded = next(result["loaded"] for (name, _), result in after.items() if name == codebase)
+        line = f"{codebase:>16}: {', '.join(loaded) or '-'}"
+        if before:
+            previous = next(result["loaded"] for (name, _), result in before.items() if name == codebase)
+            line += f"  (before: {', '.join(previous) or '-'})"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
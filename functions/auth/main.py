@@ -1,92 +1,188 @@
+# Imported first, so the startup time it records covers every import below
+import telemetry
+
 import json
 import time
-from cryptography.fernet import Fernet
-from firebase_admin import initialize_app
+from concurrent.futures import ThreadPoolExecutor
 from firebase_functions import https_fn
 from firebase_functions.options import set_global_options
-from firebase_functions.params import StringParam
-from google.cloud import firestore_v1
+from firebase_functions.params import IntParam, StringParam
 
-set_global_options(region="africa-south1")
+from runtime import get_fernet, get_firestore_client
+from token_cache import TokenCache, token_expires_at
 
-initialize_app()
+set_global_options(region="africa-south1")
 
 
 SECRET_KEY = StringParam("SECRET_KEY").value
 REALM_ID = StringParam("REALM_ID").value
+TOKEN_REFRESH_WINDOW_SECONDS = IntParam("TOKEN_REFRESH_WINDOW_SECONDS", default=300).value
+MAX_REALMS_PER_REQUEST = 100
 
 
 def encrypt_auth_token(token, key):
     """Encrypts the auth token dictionary using Fernet."""
-    f = Fernet(key)
+    f = get_fernet(key)
     return f.encrypt(json.dumps(token).encode())
 
 
 def decrypt_auth_token(token, key):
     """Decrypts the auth token dictionary using Fernet."""
-    f = Fernet(key)
+    f = get_fernet(key)
     return json.loads(f.decrypt(token.encode()).decode())
 
 
-def get_auth_token(realm_id: str) -> dict:
-    """Gets the auth token for a given realm ID."""
-    db = firestore_v1.Client()
-    doc_ref = db.collection("auth_tokens").document(realm_id)
-    doc = doc_ref.get()
-    return doc.to_dict()
+def get_auth_tokens(realm_ids: list[str]) -> dict[str, dict | None]:
+    """Gets the stored auth token documents for the given realm IDs in one round-trip."""
+    db = get_firestore_client()
+    doc_refs = [db.collection("auth_tokens").document(realm_id) for realm_id in realm_ids]
+    docs = {realm_id: None for realm_id in realm_ids}
+    with telemetry.span("auth.get_tokens"):
+        for doc in db.get_all(doc_refs):
+            if doc.exists:
+                docs[doc.id] = doc.to_dict()
+    return docs
 
 
-def is_token_expired(token: dict, time_type: str = "expires_in") -> bool:
-    """Checks if the auth token is expired."""
+def is_token_expired(token: dict, time_type: str = "expires_in", window_seconds: int = 0) -> bool:
+    """Checks if the auth token is expired, or will be within the given window."""
     epoch_now = round(time.time() * 1000)
-    expires_at = token.get(time_type) + token.get("createdAt")
-    return expires_at < epoch_now
+    return token_expires_at(token, time_type) - window_seconds * 1000 < epoch_now
 
 
-def refresh_auth_token(token: dict) -> dict:
+def refresh_auth_token(token: dict, realm_id: str) -> dict:
     """Simulates the refresh of the auth token."""
 
     refresh_token_expired = is_token_expired(token, "x_refresh_token_expires_in")
     if refresh_token_expired:
-        print(f"Refresh token expired for realm {REALM_ID}")
+        print(f"Refresh token expired for realm {realm_id}")
         return None
 
     token['createdAt'] = round(time.time() * 1000)
 
-    db = firestore_v1.Client()
-    doc_ref = db.collection("auth_tokens").document(REALM_ID)
+    db = get_firestore_client()
+    doc_ref = db.collection("auth_tokens").document(realm_id)
 
     encrypted_data = encrypt_auth_token(token, SECRET_KEY.encode())
-    doc_ref.set(
-        {
-            "token": encrypted_data.decode("utf-8"),
-            "created_at": token["createdAt"],
-            "expires_in": token["expires_in"],
-            "x_refresh_token_expires_in": token["x_refresh_token_expires_in"],
-        }
-    )
+    telemetry.count("auth.token_refreshes")
+    with telemetry.span("auth.save_token"):
+        doc_ref.set(
+            {
+                "token": encrypted_data.decode("utf-8"),
+                "created_at": token["createdAt"],
+                "expires_in": token["expires_in"],
+                "x_refresh_token_expires_in": token["x_refresh_token_expires_in"],
+            }
+        )
     return token
 
 
-@https_fn.on_request(max_instances=10)
-def authenticate(request: https_fn.Request) -> https_fn.Response:
-    print(f"Authenticating for realm {REALM_ID}")
-    data = get_auth_token(REALM_ID)
+def load_auth_token(realm_id: str, data: dict | None) -> dict | None:
+    """
+    Decrypts a stored auth token, refreshing it if it expires within the refresh window.
+    Returns None if there is no token for the realm, or it cannot be decrypted or refreshed, so
+    one bad realm does not fail the others in a batch.
+    """
+    if data is None:
+        print(f"No auth token stored for realm {realm_id}")
+        return None
+
+    try:
+        encrypted_token = data["token"]
 
-    encrypted_token = data.get("token")
+        print(f"Token: {encrypted_token[:8]}...{encrypted_token[-8:]}")
+
+        token = decrypt_auth_token(encrypted_token, SECRET_KEY.encode())
+
+        if is_token_expired(token, window_seconds=TOKEN_REFRESH_WINDOW_SECONDS):
+            print(f"Token expiring for realm {realm_id}")
+            token = refresh_auth_token(token, realm_id)
+        return token
+    except Exception as e:
+        telemetry.log("Failed to load auth token", severity="ERROR", realm_id=realm_id, error=repr(e))
+        telemetry.count("auth.token_load_failures")
+        return None
 
-    print(f"Token: {encrypted_token[:8]}...{encrypted_token[-8:]}")
 
-    token = decrypt_auth_token(encrypted_token, SECRET_KEY.encode())
+def load_auth_tokens(realm_ids: list[str]) -> dict[str, dict | None]:
+    """Fetches the stored tokens for all realms together, then decrypts and refreshes them in parallel."""
+    docs = get_auth_tokens(realm_ids)
+    if len(realm_ids) == 1:
+        return {realm_ids[0]: load_auth_token(realm_ids[0], docs[realm_ids[0]])}
 
-    if is_token_expired(token):
-        print(f"Token expired for realm {REALM_ID}")
-        token = refresh_auth_token(token)
-        if token is None:
-            return https_fn.Response(
-                status=401,
-                response=json.dumps({"error": "Unauthorized"}),
-                content_type="application/json",
-            )
+    with ThreadPoolExecutor(max_workers=min(len(realm_ids), 16)) as executor:
+        tokens = executor.map(lambda realm_id: load_auth_token(realm_id, docs[realm_id]), realm_ids)
+        return dict(zip(realm_ids, tokens))
+
+
+token_cache = TokenCache(load_auth_tokens, TOKEN_REFRESH_WINDOW_SECONDS)
+
+
+def get_requested_realm_ids(request: https_fn.Request) -> tuple[list[str], bool]:
+    """
+    Reads the realms to authenticate from the JSON body (`realm_id` or `realm_ids`) or the
+    `realm_id` query param, which may be repeated. Falls back to the configured REALM_ID.
+    Returns the realm IDs and whether the caller asked for a per-realm result map.
+    Raises ValueError if the body is not a JSON object or `realm_ids` is not a list.
+    """
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object")
+    if "realm_ids" in body:
+        if not isinstance(body["realm_ids"], list):
+            raise ValueError("realm_ids must be a list")
+        return [str(realm_id) for realm_id in body["realm_ids"] if realm_id], True
+    if body.get("realm_id"):
+        return [str(body["realm_id"])], False
+
+    realm_ids = request.args.getlist("realm_id")
+    if len(realm_ids) > 1:
+        return realm_ids, True
+    return realm_ids or [REALM_ID], False
+
+
+@https_fn.on_request(max_instances=10)
+@telemetry.first_invocation
+def authenticate(request: https_fn.Request) -> https_fn.Response:
+    try:
+        realm_ids, batched = get_requested_realm_ids(request)
+    except ValueError as e:
+        return https_fn.Response(
+            status=400, response=json.dumps({"error": str(e)}), content_type="application/json"
+        )
+    if not realm_ids or len(realm_ids) > MAX_REALMS_PER_REQUEST:
+        return https_fn.Response(
+            status=400,
+            response=json.dumps({"error": f"Provide between 1 and {MAX_REALMS_PER_REQUEST} realm IDs"}),
+            content_type="application/json",
+        )
+
+    telemetry.log("Authenticating", realm_ids=realm_ids)
+    with telemetry.span("auth.get_many"):
+        tokens = token_cache.get_many(realm_ids)
+    unauthorized = sum(token is None for token in tokens.values())
+    telemetry.count("auth.realms", len(tokens) - unauthorized, outcome="authorized")
+    telemetry.count("auth.realms", unauthorized, outcome="unauthorized")
+    telemetry.flush()
+
+    if batched:
+        results = {
+            realm_id: {"token": token} if token is not None else {"error": "Unauthorized"}
+            for realm_id, token in tokens.items()
+        }
+        return https_fn.Response(
+            status=200, response=json.dumps({"results": results}), content_type="application/json"
+        )
+
+    token = tokens[realm_ids[0]]
+    if token is None:
+        return https_fn.Response(
+            status=401,
+            response=json.dumps({"error": "Unauthorized"}),
+            content_type="application/json",
+        )
 
     return https_fn.Response(status=200, response=json.dumps({"token": token}), content_type="application/json")
+
+
+telemetry.record_import("auth")
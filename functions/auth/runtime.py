@@ -0,0 +1,82 @@
+"""
+Heavyweight clients created once per instance and reused across warm invocations.
+
+Every function codebase deploys only its own source directory, so each one carries a copy
+of this module. Keep the copies identical.
+"""
+from __future__ import annotations
+
+from functools import cache, wraps
+from typing import TYPE_CHECKING, Callable, TypeVar
+
+if TYPE_CHECKING:
+    import requests
+    from cryptography.fernet import Fernet
+    from firebase_admin import App
+    from google.cloud import firestore_v1
+
+T = TypeVar("T")
+
+HTTP_POOL_SIZE = 20
+HTTP_RETRIES = 3
+HTTP_RETRY_BACKOFF_SECONDS = 0.2
+
+
+@cache
+def get_firebase_app() -> App:
+    """Returns the default Firebase Admin app, initialised on first use rather than at import."""
+    import firebase_admin
+
+    return firebase_admin.initialize_app()
+
+
+def transactional(func: Callable[..., T]) -> Callable[..., T]:
+    """Like `firestore_v1.transactional`, but Firestore is only imported when the function first runs."""
+
+    @wraps(func)
+    def wrapper(transaction: firestore_v1.Transaction, *args, **kwargs) -> T:
+        from google.cloud import firestore_v1
+
+        return firestore_v1.transactional(func)(transaction, *args, **kwargs)
+
+    return wrapper
+
+
+@cache
+def get_firestore_client() -> firestore_v1.Client:
+    """Returns the instance-wide Firestore client, so the gRPC channel survives across invocations."""
+    from google.cloud import firestore_v1
+
+    return firestore_v1.Client()
+
+
+@cache
+def get_http_session() -> requests.Session:
+    """
+    Returns the instance-wide HTTP session. Connections are kept alive and pooled per host.
+    Connection errors are retried for every method, 502/503/504 responses only for idempotent ones.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_RETRY_BACKOFF_SECONDS,
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@cache
+def get_fernet(key: bytes) -> Fernet:
+    """Returns a Fernet instance for the key, built once per key."""
+    from cryptography.fernet import Fernet
+
+    return Fernet(key)
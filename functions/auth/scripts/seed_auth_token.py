@@ -1,10 +1,13 @@
 import json
 import os
+import time
 from google.cloud import firestore_v1
 from cryptography.fernet import Fernet
 
 
 SECRET_KEY = os.environ.get("SECRET_KEY")
+# Comma separated realm IDs to seed. Each realm gets a copy of the sample token
+REALM_IDS = os.environ.get("REALM_IDS", "")
 SAMPLE_AUTH_TOKEN = {
     "realmId": "123189227149329",
     "id_token": "",
@@ -25,23 +28,41 @@ def encrypt_auth_token(token, key):
 
 
 def seed_auth_token():
-    """Seeds the encrypted auth token to Firestore."""
-    encrypted_data = encrypt_auth_token(SAMPLE_AUTH_TOKEN, SECRET_KEY.encode())
+    """Seeds the encrypted auth token to Firestore for every realm in REALM_IDS."""
+    realm_ids = [realm_id.strip() for realm_id in REALM_IDS.split(",") if realm_id.strip()]
+    if not realm_ids:
+        realm_ids = [SAMPLE_AUTH_TOKEN["realmId"]]
 
     db = firestore_v1.Client()
-    doc_ref = db.collection("auth_tokens").document(SAMPLE_AUTH_TOKEN["realmId"])
-
-    doc_ref.set(
-        {
-            "token": encrypted_data.decode("utf-8"),
-            "created_at": SAMPLE_AUTH_TOKEN["createdAt"],
-            "expires_in": SAMPLE_AUTH_TOKEN["expires_in"],
-            "x_refresh_token_expires_in": SAMPLE_AUTH_TOKEN["x_refresh_token_expires_in"],
-        }
-    )
-    print(
-        f"Successfully seeded encrypted auth token for realm {SAMPLE_AUTH_TOKEN['realmId']}"
-    )
+    batch = db.batch()
+
+    count = 0
+    for realm_id in realm_ids:
+        # Stamped now, so the sample refresh token is within its lifetime when the seed is used
+        token = {**SAMPLE_AUTH_TOKEN, "realmId": realm_id, "createdAt": round(time.time() * 1000)}
+        encrypted_data = encrypt_auth_token(token, SECRET_KEY.encode())
+
+        doc_ref = db.collection("auth_tokens").document(realm_id)
+        batch.set(
+            doc_ref,
+            {
+                "token": encrypted_data.decode("utf-8"),
+                "created_at": token["createdAt"],
+                "expires_in": token["expires_in"],
+                "x_refresh_token_expires_in": token["x_refresh_token_expires_in"],
+            }
+        )
+        count += 1
+
+        # Commit in batches of 500 (limit is 500)
+        if count % 500 == 0:
+            batch.commit()
+            batch = db.batch()
+
+    if count % 500 != 0:
+        batch.commit()
+
+    print(f"Successfully seeded encrypted auth tokens for {count} realms")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+"""
+Lightweight latency and throughput instrumentation.
+
+Spans time external calls into per-name latency histograms and counters count outcomes. Both are
+aggregated in memory, which costs a dict update per call, and exported by `flush` as one structured
+JSON log line (or an OpenMetrics text dump) at most once per TELEMETRY_FLUSH_INTERVAL_SECONDS.
+Individual span and event logs are sampled at TELEMETRY_SAMPLE_RATE, errors are always logged.
+
+Startup is timed from the first import of this module, so function modules import it before
+anything else and call `record_import` once their own imports are done. `first_invocation` times
+each handler's first call on an instance, which pays for the clients and libraries loaded lazily.
+
+Every function codebase deploys only its own source directory, so each instrumented codebase
+carries a copy of this module. Keep the copies identical.
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+SAMPLE_RATE = float(os.environ.get("TELEMETRY_SAMPLE_RATE", "0.01"))
+FLUSH_INTERVAL_SECONDS = float(os.environ.get("TELEMETRY_FLUSH_INTERVAL_SECONDS", "60"))
+# "json" for Cloud Logging structured logs, "openmetrics" for a text exposition dump
+EXPORT_FORMAT = os.environ.get("TELEMETRY_FORMAT", "json")
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, math.inf)
+
+_lock = threading.Lock()
+_counters: dict[tuple[str, tuple], float] = {}
+_histograms: dict[tuple[str, tuple], list] = {}
+_last_flush = time.monotonic()
+_imported_at = time.perf_counter()
+_invoked: set[str] = set()
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def count(name: str, value: float = 1, **labels) -> None:
+    """Adds `value` to the counter `name` with the given labels."""
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value_ms: float, **labels) -> None:
+    """Records a latency in milliseconds in the histogram `name`."""
+    key = (name, _labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # [bucket counts..., count, sum]
+            histogram = _histograms[key] = [0] * len(LATENCY_BUCKETS_MS) + [0, 0.0]
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if value_ms <= bound:
+                histogram[index] += 1
+                break
+        histogram[-2] += 1
+        histogram[-1] += value_ms
+
+
+def log(event: str, severity: str = "INFO", sampled: bool = True, **fields) -> None:
+    """Writes a structured log line. Sampled lines are only written for a SAMPLE_RATE share of calls."""
+    if sampled and severity not in ("WARNING", "ERROR") and random.random() >= SAMPLE_RATE:
+        return
+    print(json.dumps({"severity": severity, "message": event, **fields}, default=str))
+
+
+@contextmanager
+def span(name: str, **labels) -> Iterator[None]:
+    """Times the block into the `name` latency histogram, labelled with its outcome."""
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException as e:
+        outcome = "error"
+        log(name, severity="ERROR", error=str(e), **labels)
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        observe(name, elapsed_ms, outcome=outcome, **labels)
+        log(name, duration_ms=round(elapsed_ms, 2), outcome=outcome, **labels)
+
+
+def record_import(module: str) -> None:
+    """Records how long `module` took to import, measured from the import of this module."""
+    elapsed_ms = (time.perf_counter() - _imported_at) * 1000
+    observe("startup.import", elapsed_ms, module=module)
+    log("startup.import", sampled=False, module=module, duration_ms=round(elapsed_ms, 2))
+
+
+def first_invocation(func: Callable[..., T]) -> Callable[..., T]:
+    """Decorates a function handler to time its first call on this instance."""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs) -> T:
+        with _lock:
+            first = func.__name__ not in _invoked
+            _invoked.add(func.__name__)
+        if not first:
+            return func(*args, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            observe("startup.first_invocation", elapsed_ms, function=func.__name__)
+            log("startup.first_invocation", sampled=False, function=func.__name__, duration_ms=round(elapsed_ms, 2))
+
+    return wrapper
+
+
+def _histogram_summary(histogram: list) -> dict:
+    total = histogram[-2]
+    summary = {"count": total, "sum_ms": round(histogram[-1], 2)}
+    for percent in (50, 95, 99):
+        # Upper bound of the bucket holding the percentile
+        rank, seen = math.ceil(total * percent / 100), 0
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            seen += histogram[index]
+            if seen >= rank:
+                summary[f"p{percent}_ms"] = bound if bound != math.inf else None
+                break
+    return summary
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value} for (name, labels), value in _counters.items()
+            ],
+            "histograms": [
+                {"name": name, "labels": dict(labels), **_histogram_summary(histogram)}
+                for (name, labels), histogram in _histograms.items()
+            ],
+        }
+
+
+def _format_labels(labels: tuple, **extra) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def render_openmetrics() -> str:
+    """Renders the counters and histograms in the OpenMetrics text format."""
+    lines = []
+    with _lock:
+        for name in sorted({name for name, _ in _counters}):
+            metric = name.replace(".", "_")
+            lines.append(f"# TYPE {metric} counter")
+            for (counter_name, labels), value in _counters.items():
+                if counter_name == name:
+                    lines.append(f"{metric}_total{_format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in _histograms}):
+            metric = name.replace(".", "_") + "_ms"
+            lines.append(f"# TYPE {metric} histogram")
+            for (histogram_name, labels), histogram in _histograms.items():
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for index, bound in enumerate(LATENCY_BUCKETS_MS):
+                    cumulative += histogram[index]
+                    le = "+Inf" if bound == math.inf else bound
+                    lines.append(f"{metric}_bucket{_format_labels(labels, le=le)} {cumulative}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram[-2]}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {round(histogram[-1], 2)}")
+    lines.append("# EOF")
+    return "\n".join(lines)
+
+
+def flush(force: bool = False) -> None:
+    """Exports the aggregated metrics if the flush interval has passed. Call at the end of each invocation."""
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < FLUSH_INTERVAL_SECONDS:
+        return
+    _last_flush = now
+    if EXPORT_FORMAT == "openmetrics":
+        print(render_openmetrics())
+    else:
+        print(json.dumps({"severity": "INFO", "message": "telemetry", **snapshot()}, default=str))
@@ -0,0 +1,78 @@
+"""
+Shipment message encoding for the shipment queue.
+
+Messages declare their format in the `content_type` attribute, with `schema` naming the payload
+layout and `content_encoding` set when the payload is compressed. Messages without a
+`content_type` are JSON, which is what the producer published before these attributes existed.
+
+The msgpack layout `shipment.v1` is an array of the SHIPMENT_FIELDS values in order followed by
+a map of any other fields, so the common field names are not repeated in every message. New
+fields must only ever be appended to SHIPMENT_FIELDS, in a new schema version.
+
+The producer and consumer codebases each deploy only their own directory, so each carries a copy
+of this module. Keep the copies identical.
+"""
+import gzip
+import json
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/msgpack"
+SCHEMA_V1 = "shipment.v1"
+GZIP = "gzip"
+# Compression only pays for itself on larger payloads
+COMPRESSION_THRESHOLD_BYTES = 1024
+SHIPMENT_FIELDS = (
+    "id",
+    "order_id",
+    "reference",
+    "status",
+    "origin",
+    "destination",
+    "last_updated",
+    "updated_at",
+    "created_at",
+)
+
+
+def encode_shipment(shipment: dict, encoding: str = "json") -> tuple[bytes, dict[str, str]]:
+    """Encodes a shipment as "json" or "msgpack". Returns the payload and the attributes describing it."""
+    if encoding == "msgpack":
+        import msgpack
+
+        # Explicit nulls go in the map, so they survive the round trip
+        extra = {key: value for key, value in shipment.items() if key not in SHIPMENT_FIELDS or value is None}
+        data = msgpack.packb([*(shipment.get(field) for field in SHIPMENT_FIELDS), extra])
+        attributes = {"content_type": CONTENT_TYPE_MSGPACK, "schema": SCHEMA_V1}
+    elif encoding == "json":
+        data = json.dumps(shipment, separators=(",", ":")).encode("utf-8")
+        attributes = {"content_type": CONTENT_TYPE_JSON}
+    else:
+        raise ValueError(f"Unknown message encoding {encoding}")
+
+    if len(data) > COMPRESSION_THRESHOLD_BYTES:
+        data = gzip.compress(data, compresslevel=6)
+        attributes["content_encoding"] = GZIP
+    return data, attributes
+
+
+def decode_shipment(data: bytes, attributes: dict[str, str] | None) -> dict:
+    """Decodes a shipment message according to its attributes. Raises ValueError for unknown formats."""
+    attributes = attributes or {}
+    if attributes.get("content_encoding") == GZIP:
+        data = gzip.decompress(data)
+    elif attributes.get("content_encoding"):
+        raise ValueError(f"Unknown content encoding {attributes['content_encoding']}")
+
+    content_type = attributes.get("content_type", CONTENT_TYPE_JSON)
+    if content_type == CONTENT_TYPE_JSON:
+        return json.loads(data)
+    if content_type == CONTENT_TYPE_MSGPACK:
+        if attributes.get("schema") != SCHEMA_V1:
+            raise ValueError(f"Unknown schema {attributes.get('schema')}")
+        import msgpack
+
+        *values, extra = msgpack.unpackb(data)
+        shipment = {field: value for field, value in zip(SHIPMENT_FIELDS, values) if value is not None}
+        shipment.update(extra)
+        return shipment
+    raise ValueError(f"Unknown content type {content_type}")
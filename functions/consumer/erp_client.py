@@ -0,0 +1,194 @@
+"""
+Circuit breaker and adaptive concurrency limit for calls to the ERP.
+
+The breaker state is shared by every consumer instance through a Firestore document and cached
+in memory for a few seconds, so a closed breaker costs no reads per message. An instance that
+sees `failure_threshold` consecutive ERP failures opens the breaker for all of them. Once
+`open_until` passes the breaker is half-open: each instance lets one request through at a time.
+A success closes the breaker, a failure reopens it for twice as long, up to `max_open_seconds`.
+
+The AIMD limit bounds ERP requests in flight per instance (or the batch size in batch mode).
+Responses faster than the target latency raise it by about one per round trip, slow responses
+and failures halve it.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Callable, TypeVar
+
+from google.cloud import firestore_v1
+
+import telemetry
+
+T = TypeVar("T")
+
+
+class CircuitState(Enum):
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+
+class ErpUnavailable(Exception):
+    """
+    Raised instead of calling the ERP while the breaker is open or the concurrency limit is reached.
+    The push trigger retries, so Pub/Sub redelivers the message with its own backoff.
+    """
+
+
+def is_erp_failure(error: Exception) -> bool:
+    """Timeouts, connection errors, 429 and 5xx responses count against the ERP. Other 4xx do not."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return True
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        get_state_ref: Callable[[], firestore_v1.DocumentReference],
+        failure_threshold: int = 5,
+        open_seconds: int = 30,
+        max_open_seconds: int = 600,
+        cache_seconds: float = 5,
+    ):
+        self._get_state_ref = get_state_ref
+        self._failure_threshold = failure_threshold
+        self._base_open_seconds = open_seconds
+        self._max_open_seconds = max_open_seconds
+        self._cache_seconds = cache_seconds
+        self._open_seconds = open_seconds
+        self._open_until: float | None = None
+        self._failures = 0
+        self._synced_at = float("-inf")
+        self._guard = threading.Lock()
+
+    def state(self) -> CircuitState:
+        self._sync()
+        if self._open_until is None:
+            return CircuitState.CLOSED
+        if time.time() < self._open_until:
+            return CircuitState.OPEN
+        return CircuitState.HALF_OPEN
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker goes half-open, or 0 if it is not open."""
+        if self._open_until is None:
+            return 0
+        return max(0.0, self._open_until - time.time())
+
+    def record_success(self) -> None:
+        with self._guard:
+            self._failures = 0
+            if self._open_until is None or time.time() < self._open_until:
+                return
+            self._open_until = None
+            self._open_seconds = self._base_open_seconds
+        self._save(CircuitState.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._guard:
+            self._failures += 1
+            if self._open_until is not None:
+                if time.time() < self._open_until:
+                    return
+                # The half-open trial failed
+                self._open_seconds = min(self._open_seconds * 2, self._max_open_seconds)
+            elif self._failures < self._failure_threshold:
+                return
+            self._open_until = time.time() + self._open_seconds
+        self._save(CircuitState.OPEN)
+
+    def _sync(self) -> None:
+        now = time.monotonic()
+        if now - self._synced_at < self._cache_seconds:
+            return
+        self._synced_at = now
+        try:
+            data = self._get_state_ref().get().to_dict() or {}
+        except Exception as e:
+            # Keep the local view rather than blocking the ERP on a Firestore hiccup
+            telemetry.log("Error reading circuit breaker state", severity="WARNING", error=str(e))
+            return
+
+        with self._guard:
+            if data.get("state") == CircuitState.OPEN.value and data.get("open_until"):
+                self._open_until = data["open_until"].timestamp()
+                self._open_seconds = data.get("open_seconds", self._base_open_seconds)
+            else:
+                self._open_until = None
+                self._open_seconds = self._base_open_seconds
+
+    def _save(self, state: CircuitState) -> None:
+        open_until = self._open_until
+        telemetry.count("consumer.circuit_transitions", state=state.value.lower())
+        telemetry.log(
+            "Circuit breaker state changed", severity="WARNING", state=state.value, open_seconds=self._open_seconds
+        )
+        try:
+            self._get_state_ref().set(
+                {
+                    "state": state.value,
+                    "open_until": datetime.fromtimestamp(open_until, timezone.utc) if open_until else None,
+                    "open_seconds": self._open_seconds,
+                    "updated_at": firestore_v1.SERVER_TIMESTAMP,
+                },
+                merge=True,
+            )
+        except Exception as e:
+            telemetry.log("Error saving circuit breaker state", severity="WARNING", error=str(e))
+
+
+class AdaptiveLimit:
+    def __init__(self, initial: int, minimum: int, maximum: int, target_latency_ms: float):
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._minimum = minimum
+        self._maximum = maximum
+        self._target_latency_ms = target_latency_ms
+        self._in_flight = 0
+        self._guard = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def try_acquire(self, probe: bool = False) -> bool:
+        """Takes a slot if fewer requests than the limit are in flight. A probe only runs alone."""
+        with self._guard:
+            if self._in_flight >= (1 if probe else int(self._limit)):
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self) -> None:
+        with self._guard:
+            self._in_flight -= 1
+
+    def record(self, latency_ms: float, ok: bool) -> None:
+        with self._guard:
+            if ok and latency_ms <= self._target_latency_ms:
+                self._limit = min(self._maximum, self._limit + 1 / self._limit)
+            else:
+                self._limit = max(self._minimum, self._limit / 2)
+
+
+def call_erp(breaker: CircuitBreaker, limit: AdaptiveLimit, send: Callable[[], T]) -> T:
+    """Runs an ERP request, feeding its outcome to the breaker and its latency to the limit."""
+    started = time.perf_counter()
+    try:
+        result = send()
+    except Exception as e:
+        latency_ms = (time.perf_counter() - started) * 1000
+        if is_erp_failure(e):
+            breaker.record_failure()
+            limit.record(latency_ms, ok=False)
+        else:
+            # The ERP answered, so it is up even though it rejected the request
+            breaker.record_success()
+            limit.record(latency_ms, ok=True)
+        raise
+    breaker.record_success()
+    limit.record((time.perf_counter() - started) * 1000, ok=True)
+    return result
@@ -1,60 +1,208 @@
-from datetime import datetime
+from __future__ import annotations
+
+# Imported first, so the startup time it records covers every import below
+import telemetry
+
+import base64
+import os
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from functools import cache
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from dateutil import parser
-from dateutil.tz import tzutc
-import requests
+from typing import TYPE_CHECKING, Iterator
 
-from firebase_functions import pubsub_fn
+from firebase_functions import pubsub_fn, scheduler_fn
 from firebase_functions.options import set_global_options
-from firebase_admin import initialize_app
+from google.api_core.exceptions import AlreadyExists, DeadlineExceeded, FailedPrecondition
+# Every function here reads and writes Firestore, so deferring it would only move its import
+# into the first invocation. Pub/Sub is only used by the batch consumer and is imported there.
 from google.cloud import firestore_v1
-from firebase_functions.params import StringParam
+from google.cloud.firestore_v1.base_query import FieldFilter
+from firebase_functions.params import IntParam, StringParam
 
-set_global_options(region="europe-west3", max_instances=10)
+from codec import decode_shipment
+from dates import parse_date
+from erp_client import AdaptiveLimit, CircuitBreaker, CircuitState, ErpUnavailable, call_erp
+from runtime import get_firestore_client, get_http_session
+
+if TYPE_CHECKING:
+    from google.cloud import pubsub_v1
 
-initialize_app()
+set_global_options(region="europe-west3", max_instances=10)
 
 API_KEY = "dummy-api-key"
 ERP_API_BASE_URL = StringParam("ERP_API_BASE_URL").value
+ERP_BATCH_API_URL = StringParam("ERP_BATCH_API_URL", default="").value
 HEADERS = {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"}
+ERP_TIMEOUT_SECONDS = IntParam("ERP_TIMEOUT_SECONDS", default=10).value
+# ERP responses slower than this shrink the concurrency limit (and the batch size in batch mode)
+ERP_TARGET_LATENCY_MS = IntParam("ERP_TARGET_LATENCY_MS", default=2000).value
+# Requests each push instance runs at once, and the ceiling of its adaptive ERP concurrency limit.
+# The ERP sees at most ERP_MAX_CONCURRENCY times max_instances requests in flight
+ERP_MAX_CONCURRENCY = IntParam("ERP_MAX_CONCURRENCY", default=10).value
+CIRCUIT_FAILURE_THRESHOLD = IntParam("CIRCUIT_FAILURE_THRESHOLD", default=5).value
+CIRCUIT_OPEN_SECONDS = IntParam("CIRCUIT_OPEN_SECONDS", default=30).value
+# Also the longest a nacked message is held back, which Pub/Sub caps at 600 seconds
+CIRCUIT_MAX_OPEN_SECONDS = 600
+
+# "push" handles one message per invocation. "batch" pulls groups of messages from a pull subscription
+CONSUMER_MODE = StringParam("CONSUMER_MODE", default="push").value
+CONSUMER_BATCH_SIZE = IntParam("CONSUMER_BATCH_SIZE", default=100).value
+# Each message takes two writes (lock and shipment version) and a commit is limited to 500 writes
+MAX_BATCH_SIZE = 250
+BATCH_CONSUMER_TIME_BUDGET_SECONDS = 50
+# A lock is held for LOCK_LEASE_SECONDS and extended while its push is in flight. An expired lease
+# means its holder died, so the event can be taken over
+LOCK_LEASE_SECONDS = IntParam("LOCK_LEASE_SECONDS", default=60).value
+MAX_RETRY_COUNT = IntParam("MAX_RETRY_COUNT", default=5).value
+SWEEP_PAGE_SIZE = 250
+SWEEPER_TIME_BUDGET_SECONDS = 240
+# Finished ledger entries are folded into shipment-versions after LEDGER_COMPACTION_GRACE_MINUTES.
+# Every other COMPLETED, FAILED or DEAD_LETTERED entry is deleted by the Firestore TTL policy on
+# expire_at, so the ledger stays bounded even for events that are never delivered again.
+# The sweeper and compactor queries need (status, lease_expires_at) and (status, processed_at)
+# indexes. Both index an increasing timestamp, so every ledger write lands at the tail of those
+# index ranges. That caps sustained ledger writes at a few hundred per second, while the ledger
+# documents themselves are spread out by their hashed keys
+LEDGER_COMPACTION_GRACE_MINUTES = IntParam("LEDGER_COMPACTION_GRACE_MINUTES", default=60).value
+LEDGER_RETENTION_DAYS = IntParam("LEDGER_RETENTION_DAYS", default=7).value
+COMPACTION_PAGE_SIZE = 250
+COMPACTOR_TIME_BUDGET_SECONDS = 240
+PROJECT_ID = os.environ.get("GCLOUD_PROJECT", "yoco-logistics-intergration")
+TOPIC_ID = "erp-order-status-update-queue"
+SUBSCRIPTION_ID = "erp-order-status-update-batch"
+
+# Subscription path -> when this instance first saw the subscription exist
+known_subscriptions: dict[str, datetime] = {}
+
+erp_breaker = CircuitBreaker(
+    lambda: get_firestore_client().collection("system-state").document("erp-circuit-breaker"),
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_OPEN_SECONDS,
+    CIRCUIT_MAX_OPEN_SECONDS,
+)
+push_limit = AdaptiveLimit(ERP_MAX_CONCURRENCY, 1, ERP_MAX_CONCURRENCY, ERP_TARGET_LATENCY_MS)
+batch_limit = AdaptiveLimit(
+    min(CONSUMER_BATCH_SIZE, MAX_BATCH_SIZE), 1, min(CONSUMER_BATCH_SIZE, MAX_BATCH_SIZE), ERP_TARGET_LATENCY_MS
+)
 
 
 class ProcessingStatus(Enum):
     PROCESSING = "PROCESSING"
     COMPLETED = "COMPLETED"
     FAILED = "FAILED"
+    DEAD_LETTERED = "DEAD_LETTERED"
 
 
-def parse_date(value) -> datetime:
-    if not isinstance(value, (str, datetime)):
-        raise TypeError('parse_date() first argument must be either type str or datetime')
-    if isinstance(value, str):
-        value = parser.parse(value)
-    if value.tzinfo is None:
-        value = value.replace(tzinfo=tzutc())
-    return value
+class LockOutcome(Enum):
+    ACQUIRED = "ACQUIRED"
+    # Taken over from a failed attempt
+    RETRY = "RETRY"
+    # Taken over from a holder whose lease expired
+    EXPIRED = "EXPIRED"
+    # Out of retries, left for the sweeper to dead-letter
+    EXHAUSTED = "EXHAUSTED"
+    # Already completed
+    HELD = "HELD"
+    # Another delivery holds a live lease. Left unacknowledged, so Pub/Sub delivers it again
+    IN_PROGRESS = "IN_PROGRESS"
+    STALE = "STALE"
+
+
+ACQUIRED_OUTCOMES = (LockOutcome.ACQUIRED, LockOutcome.RETRY, LockOutcome.EXPIRED)
+
+
+class EventInProgress(Exception):
+    """
+    Raised for a push delivery whose event is held by another live lease. The event is only
+    acknowledged once it is done, so a holder that dies still leaves a delivery to take it over.
+    """
+
+
+def check_shipment(shipment) -> datetime:
+    """
+    Checks a decoded message is a shipment with a string id and a valid last_updated, which it
+    returns parsed. Raises ValueError otherwise, so the message is acked as invalid rather than
+    redelivered forever.
+    """
+    if not isinstance(shipment, dict):
+        raise ValueError("Message is not a shipment object")
+    if not shipment.get("id") or not isinstance(shipment["id"], str):
+        raise ValueError("Shipment has no string id")
+    try:
+        return parse_date(shipment.get("last_updated"))
+    except (TypeError, ValueError):
+        raise ValueError("Shipment has no valid last_updated")
 
 
 def get_event_message_payload(event: pubsub_fn.CloudEvent[pubsub_fn.MessagePublishedData]) -> dict | None:
+    message = event.data.message
     try:
-        message = event.data.message.json
-        print(f"Message: {message}")
-        return message
+        shipment = decode_shipment(base64.b64decode(message.data), message.attributes)
+        check_shipment(shipment)
+        return shipment
     except Exception as e:
-        print(f"Error decoding message: {e}")
+        telemetry.log("Error decoding message", severity="WARNING", message_id=event.id, error=str(e))
         return None
 
 
-@firestore_v1.transactional
-def acquire_lock(transaction, doc_ref, shipment_id, updated_at_raw):
-    snapshot = doc_ref.get(transaction=transaction)
-    if snapshot.exists:
-        data = snapshot.to_dict()
-        status = data.get("status")
+def get_version_ms(last_updated: datetime) -> int:
+    return round(last_updated.timestamp() * 1000)
+
+
+def get_event_key(shipment_id: str, last_updated: datetime) -> str:
+    # The hash prefix spreads ledger writes over the key space whatever the shipment IDs look like
+    prefix = zlib.crc32(shipment_id.encode()) & 0xFFFF
+    return f"{prefix:04x}-{shipment_id}-{get_version_ms(last_updated)}"
+
+
+def get_ledger_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(days=LEDGER_RETENTION_DAYS)
+
+
+def get_event_refs(
+    db: firestore_v1.Client, shipment_id: str, last_updated: datetime
+) -> tuple[firestore_v1.DocumentReference, firestore_v1.DocumentReference]:
+    """Returns the lock document for the event and the version document for its shipment."""
+    event_ref = db.collection("order-status-updates").document(get_event_key(shipment_id, last_updated))
+    version_ref = db.collection("shipment-versions").document(shipment_id)
+    return event_ref, version_ref
+
+
+def is_stale_version(version_snapshot, last_updated: datetime) -> bool:
+    """A version is stale once a newer version of the same shipment has been accepted for push."""
+    if not version_snapshot.exists:
+        return False
+    return get_version_ms(last_updated) < version_snapshot.to_dict().get("version_ms", 0)
+
+
+def is_applied_version(version_snapshot, last_updated: datetime) -> bool:
+    """
+    Whether this version, or a newer one, already reached the ERP. The shipment summary answers
+    this on its own, so dedup stays one read however much of the ledger has been compacted away.
+    """
+    if not version_snapshot.exists:
+        return False
+    return get_version_ms(last_updated) <= version_snapshot.to_dict().get("applied_version_ms", -1)
+
+
+def get_lease_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=LOCK_LEASE_SECONDS)
 
-        if status != ProcessingStatus.FAILED.value:
-            return False
 
+def is_lease_expired(data: dict) -> bool:
+    # Locks taken before leases existed expire LOCK_LEASE_SECONDS after they were created
+    lease_expires_at = data.get("lease_expires_at")
+    if lease_expires_at is None and data.get("created_at") is not None:
+        lease_expires_at = data["created_at"] + timedelta(seconds=LOCK_LEASE_SECONDS)
+    return lease_expires_at is not None and lease_expires_at < datetime.now(timezone.utc)
+
+
+def set_lock(transaction, doc_ref, version_ref, shipment_id, updated_at_raw, owner) -> None:
     transaction.set(
         doc_ref,
         {
@@ -63,48 +211,521 @@ def acquire_lock(transaction, doc_ref, shipment_id, updated_at_raw):
             "shipment_id": shipment_id,
             "updated_at": updated_at_raw,
             "retry_count": firestore_v1.Increment(1),
+            "owner": owner,
+            "lease_expires_at": get_lease_expiry(),
         },
         merge=True,
     )
-    return True
+    transaction.set(version_ref, {"version_ms": firestore_v1.Maximum(get_version_ms(updated_at_raw))}, merge=True)
+
+
+def set_applied(writer, version_ref, updated_at_raw) -> None:
+    version_ms = get_version_ms(updated_at_raw)
+    writer.set(
+        version_ref,
+        {"applied_version_ms": firestore_v1.Maximum(version_ms), "applied_at": firestore_v1.SERVER_TIMESTAMP},
+        merge=True,
+    )
+
+
+def get_lock_outcome(snapshot, version_snapshot, updated_at_raw) -> LockOutcome:
+    if is_stale_version(version_snapshot, updated_at_raw):
+        return LockOutcome.STALE
+    if is_applied_version(version_snapshot, updated_at_raw):
+        return LockOutcome.HELD
+    if not snapshot.exists:
+        return LockOutcome.ACQUIRED
+    data = snapshot.to_dict()
+    status = data.get("status")
+    if status == ProcessingStatus.FAILED.value:
+        outcome = LockOutcome.RETRY
+    elif status == ProcessingStatus.PROCESSING.value:
+        if not is_lease_expired(data):
+            return LockOutcome.IN_PROGRESS
+        outcome = LockOutcome.EXPIRED
+    else:
+        return LockOutcome.HELD
+    if data.get("retry_count", 0) >= MAX_RETRY_COUNT:
+        return LockOutcome.EXHAUSTED
+    return outcome
+
+
+@firestore_v1.transactional
+def acquire_lock(transaction, doc_ref, version_ref, shipment_id, updated_at_raw, owner) -> LockOutcome:
+    snapshot = doc_ref.get(transaction=transaction)
+    version_snapshot = version_ref.get(transaction=transaction)
+    outcome = get_lock_outcome(snapshot, version_snapshot, updated_at_raw)
+    if outcome in ACQUIRED_OUTCOMES:
+        set_lock(transaction, doc_ref, version_ref, shipment_id, updated_at_raw, owner)
+    return outcome
 
 
-@pubsub_fn.on_message_published(topic="erp-order-status-update-queue")
+@firestore_v1.transactional
+def acquire_locks(
+    transaction,
+    events: dict[str, tuple[firestore_v1.DocumentReference, firestore_v1.DocumentReference, str, datetime]],
+    owner: str,
+) -> dict[str, LockOutcome]:
+    """
+    Acquires the locks for a group of events in one transaction. `events` maps event keys to
+    (doc_ref, version_ref, shipment_id, last_updated), with at most one event per shipment.
+    Returns the lock outcome of each event key.
+    """
+    snapshots = {
+        snapshot.reference.path: snapshot
+        for snapshot in transaction.get_all([ref for event in events.values() for ref in event[:2]])
+    }
+
+    outcomes = {}
+    for event_key, (ref, version_ref, shipment_id, updated_at_raw) in events.items():
+        outcome = get_lock_outcome(snapshots[ref.path], snapshots[version_ref.path], updated_at_raw)
+        if outcome in ACQUIRED_OUTCOMES:
+            set_lock(transaction, ref, version_ref, shipment_id, updated_at_raw, owner)
+        outcomes[event_key] = outcome
+    return outcomes
+
+
+@firestore_v1.transactional
+def extend_leases(transaction, refs: list[firestore_v1.DocumentReference], owner: str) -> None:
+    """Pushes back the lease of every lock in `refs` that is still held by `owner`."""
+    lease_expires_at = get_lease_expiry()
+    for snapshot in transaction.get_all(refs):
+        data = snapshot.to_dict() or {}
+        if data.get("owner") == owner and data.get("status") == ProcessingStatus.PROCESSING.value:
+            transaction.update(snapshot.reference, {"lease_expires_at": lease_expires_at})
+
+
+@contextmanager
+def hold_leases(db: firestore_v1.Client, refs: list[firestore_v1.DocumentReference], owner: str) -> Iterator[None]:
+    """Extends the leases every third of LOCK_LEASE_SECONDS until the block exits."""
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(LOCK_LEASE_SECONDS / 3):
+            try:
+                extend_leases(db.transaction(), refs, owner)
+            except Exception as e:
+                telemetry.log("Error extending leases", severity="WARNING", error=str(e))
+
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+# retry=True makes Pub/Sub redeliver every message the handler raises on, which is how deferred
+# and failed events are retried. Concurrent requests need a whole CPU, and are what push_limit bounds
+@pubsub_fn.on_message_published(
+    topic="erp-order-status-update-queue", retry=True, concurrency=ERP_MAX_CONCURRENCY, cpu=1
+)
+@telemetry.first_invocation
 def order_status_update_consumer(
     event: pubsub_fn.CloudEvent[pubsub_fn.MessagePublishedData],
 ) -> None:
     """
     Triggered by a Pub/Sub message. Pushes the update to the ERP system
-    idempotently using a locking mechanism.
+    idempotently using a locking mechanism. Raising defers the message to a redelivery.
     """
-    print(f"Consumer triggered by Pub/Sub message: {event.id}")
+    telemetry.log("Consumer triggered by Pub/Sub message", message_id=event.id)
+    if CONSUMER_MODE == "batch":
+        subscriber = get_subscriber()
+        confirmed_at = ensure_subscription_exists(subscriber, subscriber.subscription_path(PROJECT_ID, SUBSCRIPTION_ID))
+        if parse_date(event.data.message.publish_time) > confirmed_at:
+            # The batch consumer handles its own copy of the message from the pull subscription
+            return
+        # The message may predate the subscription, so the batch consumer might never see it. It is
+        # pushed here as well, and the ledger skips whichever copy comes second
+
+    state = erp_breaker.state()
+    if state is CircuitState.OPEN or not push_limit.try_acquire(probe=state is CircuitState.HALF_OPEN):
+        # Defer before taking the lock, so the redelivery costs neither a transaction nor an ERP call
+        reason = "circuit_open" if state is CircuitState.OPEN else "concurrency_limit"
+        telemetry.count("consumer.events", outcome="deferred", reason=reason)
+        telemetry.flush()
+        raise ErpUnavailable(f"ERP unavailable ({state.value}, {reason}). Deferring.")
 
+    try:
+        process_event(event)
+    finally:
+        push_limit.release()
+        telemetry.flush()
+
+
+def post_to_erp(url: str, body: dict):
+    response = get_http_session().post(url, json=body, headers=HEADERS, timeout=ERP_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response
+
+
+def process_event(event: pubsub_fn.CloudEvent[pubsub_fn.MessagePublishedData]) -> None:
     shipment = get_event_message_payload(event)
     if shipment is None:
+        telemetry.count("consumer.events", outcome="invalid")
         return
 
     shipment_id = shipment.get("id")
     last_updated = parse_date(shipment.get("last_updated"))
 
-    db = firestore_v1.Client()
-    event_key = f"{shipment_id}-{round(last_updated.timestamp() * 1000)}"
-    processed_ref = db.collection("order-status-updates").document(event_key)
+    db = get_firestore_client()
+    event_key = get_event_key(shipment_id, last_updated)
+    processed_ref, version_ref = get_event_refs(db, shipment_id, last_updated)
 
     transaction = db.transaction()
-    if not acquire_lock(transaction, processed_ref, shipment_id, last_updated):
-        print(f"Event {event_key} already processed or in progress. Skipping.")
+    owner = uuid.uuid4().hex
+    with telemetry.span("consumer.acquire_lock"):
+        outcome = acquire_lock(transaction, processed_ref, version_ref, shipment_id, last_updated, owner)
+    if outcome is LockOutcome.IN_PROGRESS:
+        telemetry.count("consumer.events", outcome="deferred", reason="in_progress")
+        raise EventInProgress(f"Event {event_key} is in progress. Deferring.")
+    if outcome not in ACQUIRED_OUTCOMES:
+        telemetry.count("consumer.events", outcome="skipped", reason=outcome.value.lower())
+        telemetry.log("Event already processed or stale. Skipping.", event_key=event_key)
         return
+    if outcome is not LockOutcome.ACQUIRED:
+        telemetry.count("consumer.events", outcome="retried", reason=outcome.value.lower())
 
-    print(f"Processing shipment {shipment_id} last_updated {last_updated}")
+    telemetry.log("Processing shipment", shipment_id=shipment_id, last_updated=last_updated)
     try:
-        response = requests.post(ERP_API_BASE_URL, json=shipment, headers=HEADERS, timeout=30)
-        response.raise_for_status()
-        print(f"Successfully pushed to ERP: {response.status_code}")
+        with telemetry.span("consumer.erp_push"), hold_leases(db, [processed_ref], owner):
+            call_erp(erp_breaker, push_limit, lambda: post_to_erp(ERP_API_BASE_URL, shipment))
 
-        processed_ref.update({"status": "COMPLETED", "processed_at": firestore_v1.SERVER_TIMESTAMP})
+        with telemetry.span("consumer.complete_write"):
+            batch = db.batch()
+            batch.update(
+                processed_ref,
+                {
+                    "status": ProcessingStatus.COMPLETED.value,
+                    "processed_at": firestore_v1.SERVER_TIMESTAMP,
+                    "expire_at": get_ledger_expiry(),
+                },
+            )
+            set_applied(batch, version_ref, last_updated)
+            batch.commit()
+        telemetry.count("consumer.events", outcome="processed")
     except Exception as e:
-        print(f"Failed to push to ERP: {e}")
+        telemetry.count("consumer.events", outcome="failed")
         processed_ref.update(
-            {"status": ProcessingStatus.FAILED.value, "error": str(e), "processed_at": firestore_v1.SERVER_TIMESTAMP}
+            {
+                "status": ProcessingStatus.FAILED.value,
+                "error": str(e),
+                "processed_at": firestore_v1.SERVER_TIMESTAMP,
+                "expire_at": get_ledger_expiry(),
+            }
         )
         raise e
+
+
+@cache
+def get_subscriber() -> pubsub_v1.SubscriberClient:
+    from google.cloud import pubsub_v1
+
+    return pubsub_v1.SubscriberClient()
+
+
+def ensure_subscription_exists(subscriber: pubsub_v1.SubscriberClient, subscription_path: str) -> datetime:
+    """Creates the subscription if it is missing. Returns when this instance first saw it exist."""
+    if subscription_path in known_subscriptions:
+        return known_subscriptions[subscription_path]
+    try:
+        subscriber.create_subscription(
+            request={
+                "name": subscription_path,
+                "topic": subscriber.topic_path(PROJECT_ID, TOPIC_ID),
+                "ack_deadline_seconds": 60,
+                "enable_message_ordering": True,
+            }
+        )
+        print(f"Subscription {subscription_path} created.")
+    except AlreadyExists:
+        pass
+    return known_subscriptions.setdefault(subscription_path, datetime.now(timezone.utc))
+
+
+def push_shipments_batch(shipments: list[dict]) -> list[str | None]:
+    """
+    Sends a group of shipments to the ERP batch endpoint. Returns an error message per shipment,
+    or None where the ERP accepted the update.
+    """
+    response = call_erp(erp_breaker, batch_limit, lambda: post_to_erp(ERP_BATCH_API_URL, {"shipments": shipments}))
+    results = response.json().get("results", [])
+    if len(results) != len(shipments):
+        raise ValueError(f"ERP returned {len(results)} results for {len(shipments)} shipments")
+    return [None if 200 <= result.get("status", 500) < 300 else str(result.get("message")) for result in results]
+
+
+def process_message_batch(db: firestore_v1.Client, received_messages: list) -> tuple[list[str], list[str]]:
+    """
+    Processes a group of pulled messages: one transaction for the locks, one ERP call and one
+    batched write for the completion statuses. Returns the ack IDs to ack and to nack.
+    """
+    ack_ids, nack_ids = [], []
+    events = {}
+    pending = {}
+    latest = {}
+    for received in received_messages:
+        try:
+            shipment = decode_shipment(received.message.data, dict(received.message.attributes))
+            last_updated = check_shipment(shipment)
+            shipment_id = shipment["id"]
+        except Exception as e:
+            telemetry.log(
+                "Error decoding message", severity="WARNING", message_id=received.message.message_id, error=str(e)
+            )
+            telemetry.count("consumer.events", outcome="invalid")
+            ack_ids.append(received.ack_id)
+            continue
+
+        # Only the newest version of each shipment in the pull does the work. Older versions and
+        # duplicate deliveries are acked straight away
+        newest = latest.get(shipment_id)
+        if newest is not None and newest[0] >= last_updated:
+            telemetry.count("consumer.events", outcome="skipped", reason="superseded")
+            ack_ids.append(received.ack_id)
+            continue
+        if newest is not None:
+            telemetry.count("consumer.events", outcome="skipped", reason="superseded")
+            ack_ids.append(pending.pop(newest[1])[0])
+            del events[newest[1]]
+
+        event_key = get_event_key(shipment_id, last_updated)
+        latest[shipment_id] = (last_updated, event_key)
+        events[event_key] = (*get_event_refs(db, shipment_id, last_updated), shipment_id, last_updated)
+        pending[event_key] = (received.ack_id, shipment)
+
+    if not events:
+        return ack_ids, nack_ids
+
+    owner = uuid.uuid4().hex
+    with telemetry.span("consumer.acquire_locks"):
+        outcomes = acquire_locks(db.transaction(), events, owner)
+    for event_key, outcome in outcomes.items():
+        if outcome in (LockOutcome.RETRY, LockOutcome.EXPIRED):
+            telemetry.count("consumer.events", outcome="retried", reason=outcome.value.lower())
+        elif outcome is LockOutcome.IN_PROGRESS:
+            # Neither acked nor nacked, so it is redelivered once its ack deadline passes
+            telemetry.count("consumer.events", outcome="deferred", reason="in_progress")
+            pending.pop(event_key)
+        elif outcome not in ACQUIRED_OUTCOMES:
+            telemetry.count("consumer.events", outcome="skipped", reason=outcome.value.lower())
+            ack_ids.append(pending.pop(event_key)[0])
+    if not pending:
+        return ack_ids, nack_ids
+
+    event_keys = list(pending)
+    try:
+        refs = [events[event_key][0] for event_key in event_keys]
+        with telemetry.span("consumer.erp_batch_push"), hold_leases(db, refs, owner):
+            errors = push_shipments_batch([pending[event_key][1] for event_key in event_keys])
+    except Exception as e:
+        errors = [str(e)] * len(event_keys)
+
+    batch = db.batch()
+    for event_key, error in zip(event_keys, errors):
+        ack_id = pending[event_key][0]
+        update = {
+            "status": ProcessingStatus.COMPLETED.value,
+            "processed_at": firestore_v1.SERVER_TIMESTAMP,
+            "expire_at": get_ledger_expiry(),
+        }
+        if error is None:
+            set_applied(batch, events[event_key][1], events[event_key][3])
+            ack_ids.append(ack_id)
+            telemetry.count("consumer.events", outcome="processed")
+        else:
+            update.update({"status": ProcessingStatus.FAILED.value, "error": error})
+            nack_ids.append(ack_id)
+            telemetry.count("consumer.events", outcome="failed")
+        batch.update(events[event_key][0], update)
+    with telemetry.span("consumer.complete_write"):
+        batch.commit()
+    return ack_ids, nack_ids
+
+
+@scheduler_fn.on_schedule(schedule="* * * * *", max_instances=1, timeout_sec=120)
+@telemetry.first_invocation
+def order_status_update_batch_consumer(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Pulls messages from the batch subscription in groups of up to CONSUMER_BATCH_SIZE and pushes
+    each group to the ERP in a single call. Only runs when CONSUMER_MODE is "batch".
+    Failed messages are nacked individually so Pub/Sub redelivers only those. The group size
+    follows the ERP latency, and nothing is pulled while the circuit breaker is open.
+    """
+    if CONSUMER_MODE != "batch":
+        return
+    if not ERP_BATCH_API_URL:
+        # Otherwise every batch would count as an ERP failure and open the shared breaker
+        raise ValueError("ERP_BATCH_API_URL must be set when CONSUMER_MODE is batch")
+
+    db = get_firestore_client()
+    subscriber = get_subscriber()
+    subscription_path = subscriber.subscription_path(PROJECT_ID, SUBSCRIPTION_ID)
+    ensure_subscription_exists(subscriber, subscription_path)
+
+    started = time.monotonic()
+    processed = 0
+    while time.monotonic() - started < BATCH_CONSUMER_TIME_BUDGET_SECONDS:
+        state = erp_breaker.state()
+        if state is CircuitState.OPEN:
+            # Messages left in the subscription wait there for the next run
+            print(f"ERP circuit open for {erp_breaker.retry_after():.0f}s. Stopping.")
+            break
+        # A half-open breaker is probed with a single message
+        max_messages = 1 if state is CircuitState.HALF_OPEN else batch_limit.limit
+        try:
+            response = subscriber.pull(
+                request={"subscription": subscription_path, "max_messages": max_messages}, timeout=10
+            )
+        except DeadlineExceeded:
+            break
+        if not response.received_messages:
+            break
+
+        ack_ids, nack_ids = process_message_batch(db, list(response.received_messages))
+        if ack_ids:
+            subscriber.acknowledge(request={"subscription": subscription_path, "ack_ids": ack_ids})
+        if nack_ids:
+            # While the breaker is open, hold the failed messages back until it goes half-open
+            subscriber.modify_ack_deadline(
+                request={
+                    "subscription": subscription_path,
+                    "ack_ids": nack_ids,
+                    "ack_deadline_seconds": min(round(erp_breaker.retry_after()), CIRCUIT_MAX_OPEN_SECONDS),
+                }
+            )
+        processed += len(response.received_messages)
+        telemetry.count("consumer.pulled", len(response.received_messages))
+
+    print(f"Batch consumer run completed. Processed {processed} messages.")
+    telemetry.flush()
+
+
+def sweep_locks(db: firestore_v1.Client, query: firestore_v1.Query, deadline: float) -> tuple[int, int]:
+    """
+    Marks every lock matched by `query` FAILED, so the next delivery of its event takes it over,
+    or dead-letters it once it is out of retries. An event is only acknowledged once it is done,
+    so a lease left behind by a dead holder always has a delivery still to come. Each page is
+    written in one batch, and a write is skipped if the lock changed after it was read.
+    Returns (reclaimed, dead-lettered).
+    """
+    reclaimed = dead_lettered = 0
+    dead_letters = db.collection("order-status-dead-letters")
+    while time.monotonic() < deadline:
+        docs = list(query.limit(SWEEP_PAGE_SIZE).stream())
+        if not docs:
+            break
+
+        batch = db.batch()
+        page_reclaimed = page_dead_lettered = 0
+        for doc in docs:
+            data = doc.to_dict()
+            if data.get("retry_count", 0) >= MAX_RETRY_COUNT:
+                dead_letter = {
+                    **data,
+                    "error": data.get("error", "Lease expired"),
+                    "dead_lettered_at": firestore_v1.SERVER_TIMESTAMP,
+                }
+                batch.set(dead_letters.document(doc.id), dead_letter)
+                update = {"status": ProcessingStatus.DEAD_LETTERED.value}
+                page_dead_lettered += 1
+            else:
+                update = {"status": ProcessingStatus.FAILED.value, "error": "Lease expired"}
+                page_reclaimed += 1
+            update["processed_at"] = firestore_v1.SERVER_TIMESTAMP
+            update["expire_at"] = get_ledger_expiry()
+            batch.update(doc.reference, update, option=db.write_option(last_update_time=doc.update_time))
+        try:
+            batch.commit()
+        except FailedPrecondition:
+            # A holder extended or released one of the locks. Read the page again
+            continue
+        reclaimed += page_reclaimed
+        dead_lettered += page_dead_lettered
+    return reclaimed, dead_lettered
+
+
+@scheduler_fn.on_schedule(schedule="*/5 * * * *", max_instances=1, timeout_sec=300)
+@telemetry.first_invocation
+def order_status_update_lock_sweeper(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Reclaims locks whose lease expired, left behind by instances that died mid-push, and moves
+    events that ran out of retries to the order-status-dead-letters collection.
+    """
+    db = get_firestore_client()
+    locks = db.collection("order-status-updates")
+    expired = locks.where(filter=FieldFilter("status", "==", ProcessingStatus.PROCESSING.value)).where(
+        filter=FieldFilter("lease_expires_at", "<", datetime.now(timezone.utc))
+    )
+    exhausted = locks.where(filter=FieldFilter("status", "==", ProcessingStatus.FAILED.value)).where(
+        filter=FieldFilter("retry_count", ">=", MAX_RETRY_COUNT)
+    )
+
+    deadline = time.monotonic() + SWEEPER_TIME_BUDGET_SECONDS
+    reclaimed, dead_lettered = sweep_locks(db, expired, deadline)
+    dead_lettered += sweep_locks(db, exhausted, deadline)[1]
+    telemetry.count("consumer.locks_reclaimed", reclaimed)
+    telemetry.count("consumer.events", dead_lettered, outcome="dead_lettered")
+    print(f"Lock sweep completed. Reclaimed {reclaimed} expired leases, dead-lettered {dead_lettered} events.")
+    telemetry.flush(force=True)
+
+
+def compact_ledger_page(db: firestore_v1.Client, docs: list[firestore_v1.DocumentSnapshot]) -> None:
+    """Folds a page of completed ledger entries into their shipment summaries and deletes them, in one batch."""
+    summaries = {}
+    for doc in docs:
+        data = doc.to_dict()
+        version_ms = get_version_ms(data["updated_at"])
+        newest, completed = summaries.get(data["shipment_id"], (version_ms, 0))
+        summaries[data["shipment_id"]] = (max(newest, version_ms), completed + 1)
+
+    batch = db.batch()
+    for shipment_id, (version_ms, completed) in summaries.items():
+        batch.set(
+            db.collection("shipment-versions").document(shipment_id),
+            {
+                "applied_version_ms": firestore_v1.Maximum(version_ms),
+                "completed_events": firestore_v1.Increment(completed),
+                "compacted_at": firestore_v1.SERVER_TIMESTAMP,
+            },
+            merge=True,
+        )
+    for doc in docs:
+        batch.delete(doc.reference)
+    batch.commit()
+
+
+@scheduler_fn.on_schedule(schedule="0 * * * *", max_instances=1, timeout_sec=300)
+@telemetry.first_invocation
+def order_status_update_ledger_compactor(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Folds completed order-status-updates entries older than LEDGER_COMPACTION_GRACE_MINUTES into
+    one summary document per shipment in shipment-versions, then deletes them. Dedup only needs
+    the summary, so the ledger holds little more than the events in flight.
+    """
+    db = get_firestore_client()
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=LEDGER_COMPACTION_GRACE_MINUTES)
+    query = (
+        db.collection("order-status-updates")
+        .where(filter=FieldFilter("status", "==", ProcessingStatus.COMPLETED.value))
+        .where(filter=FieldFilter("processed_at", "<", cutoff))
+        .limit(COMPACTION_PAGE_SIZE)
+    )
+
+    deadline = time.monotonic() + COMPACTOR_TIME_BUDGET_SECONDS
+    compacted = 0
+    while time.monotonic() < deadline:
+        docs = list(query.stream())
+        if not docs:
+            break
+        with telemetry.span("consumer.compact_ledger"):
+            compact_ledger_page(db, docs)
+        compacted += len(docs)
+
+    telemetry.count("consumer.ledger_compacted", compacted)
+    print(f"Ledger compaction completed. Folded {compacted} events into shipment summaries.")
+    telemetry.flush(force=True)
+
+
+telemetry.record_import("consumer")
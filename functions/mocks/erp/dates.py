@@ -0,0 +1,39 @@
+"""
+Timestamp parsing shared by the functions.
+
+Every function codebase deploys only its own source directory, so each one that parses
+timestamps carries a copy of this module. Keep the copies identical.
+"""
+from datetime import datetime, timezone
+from functools import lru_cache
+
+PARSE_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_str(value: str) -> datetime:
+    try:
+        # Fast path. Covers the ISO-8601 timestamps the APIs actually send, including a "Z" suffix
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        from dateutil import parser
+
+        parsed = parser.parse(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def parse_date(value) -> datetime:
+    """
+    Parses an ISO-8601 string or datetime into a timezone aware datetime, assuming UTC when no
+    offset is given. Strings are memoised, so repeated values (checkpoints, re-polled shipments)
+    are parsed once. Formats `datetime.fromisoformat` rejects fall back to dateutil.
+    """
+    if not isinstance(value, (str, datetime)):
+        raise TypeError('parse_date() first argument must be either type str or datetime')
+    if isinstance(value, str):
+        return _parse_str(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
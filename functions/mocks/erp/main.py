@@ -1,7 +1,4 @@
 from datetime import datetime, timezone
-from dateutil import parser
-from dateutil.tz import tzutc
-from firebase_admin import initialize_app
 from firebase_functions import https_fn
 from firebase_functions.options import set_global_options
 from google.cloud import firestore_v1
@@ -9,19 +6,93 @@ import logging
 
 import json
 
+from dates import parse_date
+from runtime import get_firestore_client
+
 set_global_options(region="africa-south1")
 
-initialize_app()
 
+MAX_BATCH_SIZE = 500
+UPDATED_MESSAGE = "Order status updated successfully"
+UP_TO_DATE_MESSAGE = "Order already up to date"
+
+
+def get_shipment_error(shipment) -> str | None:
+    """Returns why a shipment update cannot be applied, or None if it is well formed."""
+    if not isinstance(shipment, dict):
+        return "Shipment is not an object"
+    if not shipment.get("order_id"):
+        return "Missing order_id"
+    if not shipment.get("status"):
+        return "Missing status"
+    try:
+        parse_date(shipment.get("last_updated"))
+    except (TypeError, ValueError):
+        return "Missing or invalid last_updated"
+    return None
+
+
+def get_shipment_update(order: dict, shipment: dict) -> dict | None:
+    """
+    Returns the fields to write for a shipment update, or None if the order already holds this
+    version of the shipment or a newer one.
+    """
+    shipment_last_updated = parse_date(shipment.get("last_updated"))
+    order_shipment_last_updated = parse_date(order["shipment"]["last_updated"])
+    if shipment_last_updated <= order_shipment_last_updated:
+        return None
+    return {
+        "status": shipment["status"],
+        "shipment": shipment,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+@firestore_v1.transactional
+def apply_shipment_updates(
+    transaction, order_refs: dict[str, firestore_v1.DocumentReference], shipments: list[dict]
+) -> tuple[list[dict], dict[str, dict]]:
+    """
+    Applies shipment updates in one transaction. The orders are read inside the transaction, so
+    a concurrent write to any of them retries the whole transaction against the new versions.
+    Each changed order gets a single partial write of status, shipment and updated_at. A malformed
+    shipment gets a 400 result of its own and does not fail the others.
+    Returns one {"order_id", "status", "message"} result per shipment, in order, and the orders.
+    """
+    orders = {}
+    if order_refs:
+        orders = {doc.id: doc.to_dict() for doc in transaction.get_all(list(order_refs.values())) if doc.exists}
+
+    results = []
+    updates = {}
+    duplicates = {}
+    for shipment in shipments:
+        error = get_shipment_error(shipment)
+        if error is not None:
+            order_id = shipment.get("order_id") if isinstance(shipment, dict) else None
+            results.append({"order_id": order_id, "status": 400, "message": error})
+            continue
+
+        order_id = shipment["order_id"]
+        if order_id not in orders:
+            results.append({"order_id": order_id, "status": 404, "message": "Order not found"})
+        else:
+            update = get_shipment_update(orders[order_id], shipment)
+            if update is None:
+                # Counted rather than rewritten, so load tests can still see duplicate deliveries
+                duplicates[order_id] = duplicates.get(order_id, 0) + 1
+                results.append({"order_id": order_id, "status": 200, "message": UP_TO_DATE_MESSAGE})
+            else:
+                orders[order_id].update(update)
+                updates.setdefault(order_id, {}).update(update)
+                results.append({"order_id": order_id, "status": 200, "message": UPDATED_MESSAGE})
 
-def parse_date(value) -> datetime:
-    if not isinstance(value, (str, datetime)):
-        raise TypeError('parse_date() first argument must be either type str or datetime')
-    if isinstance(value, str):
-        value = parser.parse(value)
-    if value.tzinfo is None:
-        value = value.replace(tzinfo=tzutc())
-    return value
+    for order_id in updates.keys() | duplicates.keys():
+        fields = updates.get(order_id, {})
+        if order_id in duplicates:
+            fields["duplicate_updates"] = firestore_v1.Increment(duplicates[order_id])
+        transaction.update(order_refs[order_id], fields)
+    return results, orders
 
 
 @https_fn.on_request(max_instances=10)
@@ -29,43 +100,60 @@ def update_shipment(request: https_fn.Request) -> https_fn.Response:
     """
     Mock and erp api endpoint for order status updates.
     Expected usage: POST with JSON body containing shipment details.
-    order_id can be in query params or body.
+    The order is only written when the shipment is newer than the one it holds.
     """
-    shipment = request.get_json(silent=True)
-    order_id = shipment.get("order_id", None)
+    shipment = request.get_json(silent=True) or {}
+    error = get_shipment_error(shipment)
+    if error is not None:
+        return https_fn.Response(error, status=400)
+    order_id = shipment["order_id"]
 
-    if not order_id:
-        return https_fn.Response("Missing order_id", status=400)
+    try:
+        db = get_firestore_client()
+        order_refs = {order_id: db.collection("orders").document(order_id)}
+        results, orders = apply_shipment_updates(db.transaction(), order_refs, [shipment])
+        result = results[0]
 
-    db = firestore_v1.Client()
-    order_doc_ref = db.collection("orders").document(order_id)
-    order_doc = order_doc_ref.get()
+        if result["status"] == 404:
+            return https_fn.Response("Order not found", status=404, content_type="application/json")
 
-    if not order_doc.exists:
-        return https_fn.Response("Order not found", status=404, content_type="application/json")
+        return https_fn.Response(
+            status=200,
+            response=json.dumps({"message": result["message"], "data": orders[order_id]}, default=str),
+            content_type="application/json"
+        )
+    except Exception as e:
+        logging.error(f"Error updating shipment: {e}")
+        return https_fn.Response(f"Internal Server Error: {str(e)}", status=500)
 
-    try:
-        order = order_doc.to_dict()
-        shipment_last_updated = parse_date(shipment.get("last_updated"))
-        order_shipment_last_updated = parse_date(order["shipment"]["last_updated"])
-
-        if shipment_last_updated <= order_shipment_last_updated and order["status"] == shipment["status"]:
-            # Simulating data corruption
-            logging.warning(f"Shipment {shipment.get('id')} already updated. Corrupting data...")
-            order["status"] = "corrupted"
-        else:
-            order["status"] = shipment["status"]
 
-        order["shipment"] = shipment
-        order["updated_at"] = datetime.now(timezone.utc).isoformat()
+@https_fn.on_request(max_instances=10)
+def update_shipments(request: https_fn.Request) -> https_fn.Response:
+    """
+    Mock and erp api batch endpoint for order status updates.
+    Expected usage: POST with JSON body {"shipments": [...]}. All updates are applied in one
+    transaction. Returns {"results": [...]} with one {"order_id", "status", "message"} entry per
+    shipment, in request order.
+    """
+    body = request.get_json(silent=True) or {}
+    shipments = body.get("shipments") if isinstance(body, dict) else None
 
-        order_doc_ref.set(order)
+    if not isinstance(shipments, list) or not shipments:
+        return https_fn.Response("Missing shipments", status=400)
+    if len(shipments) > MAX_BATCH_SIZE:
+        return https_fn.Response(f"At most {MAX_BATCH_SIZE} shipments per request", status=400)
+
+    try:
+        db = get_firestore_client()
+        order_ids = {shipment["order_id"] for shipment in shipments if get_shipment_error(shipment) is None}
+        order_refs = {order_id: db.collection("orders").document(order_id) for order_id in order_ids}
+        results, _ = apply_shipment_updates(db.transaction(), order_refs, shipments)
 
         return https_fn.Response(
             status=200,
-            response=json.dumps({"message": "Order status updated successfully", "data": order}),
+            response=json.dumps({"results": results}),
             content_type="application/json"
         )
     except Exception as e:
-        logging.error(f"Error updating shipment: {e}")
+        logging.error(f"Error updating shipments: {e}")
         return https_fn.Response(f"Internal Server Error: {str(e)}", status=500)
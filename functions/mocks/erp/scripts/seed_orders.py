@@ -1,51 +1,31 @@
-import json
+import argparse
 import os
+import sys
+
 from google.cloud import firestore_v1
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "scripts"))
+
+from bulk_loader import bulk_load, iter_json_array  # noqa: E402
 
-def seed_orders():
-    db_file_path = os.path.join(os.path.dirname(__file__), "db.json")
 
+def seed_orders(db_file_path: str, ops_per_second: int):
     print(f"Reading data from {db_file_path}")
 
     if not os.path.exists(db_file_path):
         print(f"Error: {db_file_path} does not exist.")
         return
 
-    with open(db_file_path, "r") as f:
-        data = json.load(f)
-
-    orders = data.get("orders", [])
-
-    if not orders:
-        print("No orders found in db.json")
-        return
-
     db = firestore_v1.Client()
 
     collection_name = "orders"
-    batch = db.batch()
+    print(f"Seeding orders to Firestore collection '{collection_name}'...")
 
-    print(f"Seeding {len(orders)} orders to Firestore collection '{collection_name}'...")
+    count = bulk_load(db, collection_name, iter_json_array(db_file_path, "orders"), ops_per_second=ops_per_second)
 
-    count = 0
-    for order in orders:
-        doc_id = order.get("id")
-        if not doc_id:
-            continue
-
-        doc_ref = db.collection(collection_name).document(doc_id)
-        batch.set(doc_ref, order)
-        count += 1
-
-        # Commit in batches of 500 (limit is 500)
-        if count % 500 == 0:
-            batch.commit()
-            batch = db.batch()
-            print(f"Committed {count} records...")
-
-    if count % 500 != 0:
-        batch.commit()
+    if not count:
+        print("No orders found in db.json")
+        return
 
     print(f"Successfully seeded {count} orders.")
 
@@ -54,4 +34,9 @@ if __name__ == "__main__":
     if not os.environ.get("GOOGLE_CLOUD_PROJECT"):
         os.environ["GOOGLE_CLOUD_PROJECT"] = "yoco-logistics-intergration"
 
-    seed_orders()
+    arg_parser = argparse.ArgumentParser(description="Seeds the orders collection from a JSON fixture.")
+    arg_parser.add_argument("--file", default=os.path.join(os.path.dirname(__file__), "db.json"))
+    arg_parser.add_argument("--ops-per-second", type=int, default=500, help="Raise when seeding the emulator")
+    args = arg_parser.parse_args()
+
+    seed_orders(args.file, args.ops_per_second)
@@ -1,34 +1,27 @@
-from datetime import datetime
-from dateutil import parser
-from dateutil.tz import tzutc
-from firebase_admin import initialize_app
 from firebase_functions import https_fn
 from firebase_functions.options import set_global_options
-from google.cloud import firestore_v1
+from google.cloud.firestore_v1.base_query import FieldFilter
 import logging
 import json
 
-set_global_options(region="africa-south1")
-
-initialize_app()
+from dates import parse_date
+from runtime import get_firestore_client
 
-
-def parse_date(value) -> datetime:
-    if not isinstance(value, (str, datetime)):
-        raise TypeError('parse_date() first argument must be either type str or datetime')
-    if isinstance(value, str):
-        value = parser.parse(value)
-    if value.tzinfo is None:
-        value = value.replace(tzinfo=tzutc())
-    return value
+set_global_options(region="africa-south1")
 
 
 @https_fn.on_request(max_instances=10)
 def get_shipments(request: https_fn.Request) -> https_fn.Response:
     """
     Mock and external endpoint for retrieving shipment status updates.
+    Served as a range query on the native `last_updated_at` timestamp, so the cost grows
+    with the number of changed shipments rather than the size of the collection.
+    Optional pagination: `limit` sets the page size and `last_id` together with `last_updated`
+    forms a (last_updated, id) cursor. Pages are ordered by (last_updated, id) and carry a
+    `next_cursor` to pass back for the following page, or null on the last page.
     """
     last_updated_param = request.args.get("last_updated", None)
+    last_id = request.args.get("last_id", None)
 
     if not last_updated_param:
         return https_fn.Response(status=200, response=json.dumps({"data": []}), content_type="application/json")
@@ -40,12 +33,40 @@ def get_shipments(request: https_fn.Request) -> https_fn.Response:
         return https_fn.Response(status=400, response=json.dumps({"error": message}), content_type="application/json")
 
     try:
-        db = firestore_v1.Client()
-        docs = db.collection("shipments").stream()
+        limit = int(request.args.get("limit", 0))
+        if limit < 0:
+            raise ValueError(limit)
+    except ValueError:
+        message = "Invalid limit. Use a positive integer"
+        return https_fn.Response(status=400, response=json.dumps({"error": message}), content_type="application/json")
+
+    try:
+        db = get_firestore_client()
+        # Range query on the native timestamp, backed by the (last_updated_at, id) composite index
+        query = db.collection("shipments").order_by("last_updated_at").order_by("id")
+        if last_id:
+            query = query.start_after({"last_updated_at": last_updated, "id": last_id})
+        else:
+            query = query.where(filter=FieldFilter("last_updated_at", ">", last_updated))
+        if limit:
+            query = query.limit(limit + 1)
+
+        shipments = []
+        for doc in query.stream():
+            shipment = doc.to_dict()
+            shipment.pop("last_updated_at", None)
+            shipments.append(shipment)
 
-        shipments = [doc.to_dict() for doc in docs if parse_date(doc.to_dict().get("last_updated")) > last_updated]
+        page = shipments[:limit] if limit else shipments
+        next_cursor = None
+        if limit and len(shipments) > limit:
+            next_cursor = {"last_updated": parse_date(page[-1]["last_updated"]).isoformat(), "id": page[-1]["id"]}
 
-        return https_fn.Response(status=200, response=json.dumps({"data": shipments}), content_type="application/json")
+        return https_fn.Response(
+            status=200,
+            response=json.dumps({"data": page, "next_cursor": next_cursor} if limit else {"data": page}),
+            content_type="application/json",
+        )
     except Exception as e:
         logging.error(f"Error getting shipments: {e}")
         return https_fn.Response(f"Internal Server Error: {str(e)}", status=500)
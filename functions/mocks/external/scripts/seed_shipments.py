@@ -1,51 +1,43 @@
-import json
+import argparse
 import os
+import sys
+
+from dateutil import parser
+from dateutil.tz import tzutc
 from google.cloud import firestore_v1
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "scripts"))
 
-def seed_shipments():
-    db_file_path = os.path.join(os.path.dirname(__file__), "db.json")
+from bulk_loader import bulk_load, iter_json_array  # noqa: E402
 
-    print(f"Reading data from {db_file_path}")
 
-    if not os.path.exists(db_file_path):
-        print(f"Error: {db_file_path} does not exist.")
-        return
+def with_native_timestamp(shipment: dict) -> dict:
+    # Native timestamp for the range query in get_shipments. The ISO string is kept for the payload
+    last_updated_at = parser.parse(shipment["last_updated"])
+    if last_updated_at.tzinfo is None:
+        last_updated_at = last_updated_at.replace(tzinfo=tzutc())
+    return {**shipment, "last_updated_at": last_updated_at}
 
-    with open(db_file_path, "r") as f:
-        data = json.load(f)
 
-    shipments = data.get("shipments", [])
+def seed_shipments(db_file_path: str, ops_per_second: int):
+    print(f"Reading data from {db_file_path}")
 
-    if not shipments:
-        print("No shipments found in db.json")
+    if not os.path.exists(db_file_path):
+        print(f"Error: {db_file_path} does not exist.")
         return
 
     db = firestore_v1.Client()
 
     collection_name = "shipments"
-    batch = db.batch()
-
-    print(f"Seeding {len(shipments)} shipments to Firestore collection '{collection_name}'...")
-
-    count = 0
-    for shipment in shipments:
-        doc_id = shipment.get("id")
-        if not doc_id:
-            continue
-
-        doc_ref = db.collection(collection_name).document(doc_id)
-        batch.set(doc_ref, shipment)
-        count += 1
+    print(f"Seeding shipments to Firestore collection '{collection_name}'...")
 
-        # Commit in batches of 500 (limit is 500)
-        if count % 500 == 0:
-            batch.commit()
-            batch = db.batch()
-            print(f"Committed {count} records...")
+    count = bulk_load(
+        db, collection_name, iter_json_array(db_file_path, "shipments"), with_native_timestamp, ops_per_second
+    )
 
-    if count % 500 != 0:
-        batch.commit()
+    if not count:
+        print("No shipments found in db.json")
+        return
 
     print(f"Successfully seeded {count} shipments.")
 
@@ -54,4 +46,9 @@ if __name__ == "__main__":
     if not os.environ.get("GOOGLE_CLOUD_PROJECT"):
         os.environ["GOOGLE_CLOUD_PROJECT"] = "yoco-logistics-intergration"
 
-    seed_shipments()
+    arg_parser = argparse.ArgumentParser(description="Seeds the shipments collection from a JSON fixture.")
+    arg_parser.add_argument("--file", default=os.path.join(os.path.dirname(__file__), "db.json"))
+    arg_parser.add_argument("--ops-per-second", type=int, default=500, help="Raise when seeding the emulator")
+    args = arg_parser.parse_args()
+
+    seed_shipments(args.file, args.ops_per_second)
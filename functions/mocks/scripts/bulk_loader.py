@@ -0,0 +1,120 @@
+"""
+Bulk loader shared by the mock seed scripts.
+
+Records are streamed out of the JSON fixture one at a time, so memory stays constant however
+large the file is, and written through a Firestore BulkWriter, which commits batches in
+parallel and retries failed writes with exponential backoff.
+"""
+import json
+import threading
+import time
+from typing import Callable, Iterable, Iterator
+
+from google.cloud import firestore_v1
+from google.cloud.firestore_v1.bulk_writer import BulkRetry, BulkWriterOptions, SendMode
+
+CHUNK_SIZE = 1 << 16
+MAX_WRITE_ATTEMPTS = 10
+REPORT_EVERY = 10000
+
+
+def iter_json_array(path: str, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Yields the objects of the array stored under `key` in a JSON file without loading the file.
+    The array must hold objects, as the seed fixtures do.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buffer = ""
+        marker = f'"{key}"'
+        while True:
+            start = buffer.find(marker)
+            if start != -1:
+                bracket = buffer.find("[", start + len(marker))
+                if bracket != -1:
+                    buffer = buffer[bracket + 1:]
+                    break
+                buffer = buffer[start:]
+            else:
+                # Keep enough of the tail to match a marker split across chunks
+                buffer = buffer[-len(marker):]
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buffer += chunk
+
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield record
+            position = end
+
+
+def bulk_load(
+    db: firestore_v1.Client,
+    collection_name: str,
+    records: Iterable[dict],
+    transform: Callable[[dict], dict] | None = None,
+    ops_per_second: int = 500,
+) -> int:
+    """
+    Writes each record to `collection_name` under its `id`. Records without an id are skipped.
+    `ops_per_second` is where the writer's rate limit starts; it ramps up by 50% every 5 minutes
+    as recommended for production, so raise it when seeding the emulator.
+    Returns the number of records written.
+    """
+    writer = db.bulk_writer(
+        options=BulkWriterOptions(
+            initial_ops_per_second=ops_per_second,
+            max_ops_per_second=max(ops_per_second, 10000),
+            mode=SendMode.parallel,
+            retry=BulkRetry.exponential,
+        )
+    )
+    lock = threading.Lock()
+    written = [0]
+    failed = [0]
+    started = time.monotonic()
+
+    def on_write_result(reference, result, bulk_writer) -> None:
+        with lock:
+            written[0] += 1
+            if written[0] % REPORT_EVERY == 0:
+                rate = written[0] / (time.monotonic() - started)
+                print(f"Committed {written[0]} records ({rate:.0f} rows/s)...")
+
+    def on_write_error(failure, bulk_writer) -> bool:
+        if failure.attempts < MAX_WRITE_ATTEMPTS:
+            return True
+        with lock:
+            failed[0] += 1
+        print(f"Failed to write {failure.operation.reference.id} after {failure.attempts} attempts: {failure.message}")
+        return False
+
+    writer.on_write_result(on_write_result)
+    writer.on_write_error(on_write_error)
+
+    collection = db.collection(collection_name)
+    for record in records:
+        doc_id = record.get("id")
+        if not doc_id:
+            continue
+        writer.set(collection.document(doc_id), transform(record) if transform else record)
+    writer.close()
+
+    elapsed = time.monotonic() - started
+    rate = written[0] / elapsed if elapsed else 0
+    print(f"Wrote {written[0]} records in {elapsed:.1f}s ({rate:.0f} rows/s), {failed[0]} failed.")
+    return written[0]
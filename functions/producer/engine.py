@@ -0,0 +1,190 @@
+"""
+Asyncio producer engine, used when PRODUCER_ENGINE is "async".
+
+The checkpoint read overlaps with token acquisition, later pages download while earlier ones
+are being published, and the publish futures of a page are awaited together. As with the
+sync engine, the checkpoint only moves forward over messages that were published in order.
+"""
+import asyncio
+import time
+from datetime import datetime
+
+import httpx
+from google.cloud import firestore_v1, pubsub_v1
+
+import telemetry
+from main import (
+    CHECKPOINT_START,
+    PROJECT_ID,
+    TOPIC_ID,
+    ensure_topic_exists,
+    generate_shipment_messages,
+    get_auth_headers,
+    get_auth_token,
+    get_checkpoint_update,
+    get_poll_params,
+    get_publisher,
+    parse_checkpoint,
+    parse_date,
+    resume_publishing,
+    sort_page,
+    token_cache,
+)
+from shards import Shard
+
+PREFETCH_PAGES = 2
+_DONE = object()
+
+
+async def get_checkpoint(state_ref: firestore_v1.AsyncDocumentReference) -> tuple[datetime, str | None]:
+    try:
+        return parse_checkpoint(await state_ref.get())
+    except Exception as e:
+        print(f"Error reading state: {e}")
+        return parse_date(CHECKPOINT_START), None
+
+
+@firestore_v1.async_transactional
+async def advance_checkpoint(
+    transaction, state_ref: firestore_v1.AsyncDocumentReference, cursor: tuple[datetime, str], owner: str
+) -> bool:
+    update = get_checkpoint_update(await state_ref.get(transaction=transaction), cursor, owner)
+    if update is None:
+        return False
+    transaction.set(state_ref, update, merge=True)
+    return True
+
+
+async def save_checkpoint(
+    db: firestore_v1.AsyncClient,
+    state_ref: firestore_v1.AsyncDocumentReference,
+    cursor: tuple[datetime, str],
+    owner: str,
+) -> None:
+    last_updated, last_id = cursor
+    with telemetry.span("producer.save_checkpoint"):
+        advanced = await advance_checkpoint(db.transaction(), state_ref, cursor, owner)
+    if advanced:
+        print(f"Checkpoint updated to: {last_updated} ({last_id})")
+    else:
+        print(f"Checkpoint already past {last_updated} ({last_id})")
+
+
+async def download_pages(
+    client: httpx.AsyncClient,
+    shard: Shard,
+    headers: dict,
+    last_updated: datetime,
+    last_id: str | None,
+    pages: asyncio.Queue,
+) -> None:
+    while True:
+        params = get_poll_params(last_updated, last_id)
+        with telemetry.span("producer.page_fetch"):
+            response = await client.get(shard.base_url, params=params, headers=headers)
+        if response.status_code == 401:
+            # Token revoked upstream before its expiry. Drop it so the next run fetches a new one
+            token_cache.invalidate(shard.realm_id)
+        response.raise_for_status()
+        body = response.json()
+        shipments: list = body.get("data", [])
+        if not shipments:
+            return
+
+        await pages.put(sort_page(shipments))
+
+        next_cursor = body.get("next_cursor")
+        if not next_cursor:
+            return
+        last_updated, last_id = parse_date(next_cursor["last_updated"]), next_cursor["id"]
+
+
+async def fetch_pages(
+    client: httpx.AsyncClient,
+    shard: Shard,
+    headers: dict,
+    last_updated: datetime,
+    last_id: str | None,
+    pages: asyncio.Queue,
+) -> None:
+    """Downloads pages into the queue until the backlog is exhausted. The queue bounds how far ahead it runs."""
+    try:
+        await download_pages(client, shard, headers, last_updated, last_id, pages)
+    except Exception as e:
+        # Pages already queued are still published. Cancellation is not an Exception and skips the marker
+        print(f"API Request failed: {e}")
+    await pages.put(_DONE)
+
+
+async def publish_page(
+    publisher: pubsub_v1.PublisherClient, shipments: list[dict]
+) -> tuple[tuple[datetime, str] | None, bool]:
+    """
+    Publishes a page and awaits all its futures together. Returns the cursor of the last message
+    published in order and whether the whole page was published.
+    """
+    with telemetry.span("producer.publish_page"):
+        messages = await asyncio.to_thread(generate_shipment_messages, publisher, shipments)
+        results = await asyncio.gather(
+            *(asyncio.wrap_future(message) for message, _, _ in messages), return_exceptions=True
+        )
+
+    cursor = None
+    for index, ((_, message_last_updated, shipment_id), result) in enumerate(zip(messages, results)):
+        if isinstance(result, Exception):
+            print(f"Error publishing to Pub/Sub: {result}")
+            telemetry.count("producer.shipments", index, outcome="published")
+            telemetry.count("producer.shipments", len(messages) - index, outcome="failed")
+            resume_publishing(publisher)
+            return cursor, False
+        cursor = (message_last_updated, shipment_id)
+    telemetry.count("producer.shipments", len(messages), outcome="published")
+    return cursor, True
+
+
+async def run_producer(shard: Shard, state_doc_id: str, owner: str, deadline: float) -> tuple[int, bool]:
+    """
+    Runs one producer pass for a shard whose lease `owner` holds. Returns the number of shipments
+    published and whether pages were left when the deadline passed.
+    """
+    db = firestore_v1.AsyncClient()
+    state_ref = db.collection("system-state").document(state_doc_id)
+
+    try:
+        (last_updated, last_id), token = await asyncio.gather(
+            get_checkpoint(state_ref), asyncio.to_thread(get_auth_token, shard.realm_id)
+        )
+    except Exception as e:
+        print(f"API Request failed: {e}")
+        return 0, False
+
+    print(f"Polling shard {shard.id} for updates since: {last_updated} ({last_id})")
+    pages: asyncio.Queue = asyncio.Queue(maxsize=PREFETCH_PAGES)
+    published = 0
+    backlog = False
+    async with httpx.AsyncClient(timeout=30) as client:
+        headers = get_auth_headers(token)
+        fetcher = asyncio.create_task(fetch_pages(client, shard, headers, last_updated, last_id, pages))
+        publisher = None
+        try:
+            while (page := await pages.get()) is not _DONE:
+                print(f"Found {len(page)} updates.")
+                if publisher is None:
+                    publisher = get_publisher()
+                    await asyncio.to_thread(ensure_topic_exists, publisher, PROJECT_ID, TOPIC_ID)
+
+                cursor, complete = await publish_page(publisher, page)
+                if cursor:
+                    # Keep what was published in order and let the next run pick up from there
+                    await save_checkpoint(db, state_ref, cursor, owner)
+                if not complete:
+                    break
+                published += len(page)
+                if time.monotonic() >= deadline:
+                    backlog = True
+                    break
+        finally:
+            fetcher.cancel()
+            await asyncio.gather(fetcher, return_exceptions=True)
+
+    return published, backlog
@@ -1,69 +1,255 @@
+from __future__ import annotations
+
+# Imported first, so the startup time it records covers every import below
+import telemetry
+
+import asyncio
 import os
 import json
-from typing import Any
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from typing import TYPE_CHECKING, Any, Iterator
 import requests
 
-from datetime import datetime, timezone
-from dateutil import parser
-from dateutil.tz import tzutc
+from datetime import datetime, timedelta, timezone
 
-from firebase_admin import initialize_app
-from firebase_functions import scheduler_fn
-from firebase_functions.options import set_global_options
-from firebase_functions.params import StringParam
+from firebase_functions import https_fn, scheduler_fn, tasks_fn
+from firebase_functions.options import RateLimits, RetryConfig, set_global_options
+from firebase_functions.params import IntParam, StringParam
 
-from google.cloud import pubsub_v1, firestore_v1
-from google.api_core.exceptions import NotFound
+from codec import encode_shipment
+from dates import parse_date
+from runtime import get_firebase_app, get_firestore_client, get_http_session, transactional
+from shards import Shard, is_ahead, load_shards
+from token_cache import TokenCache
+from webhooks import (
+    SIGNATURE_HEADER,
+    TIMESTAMP_HEADER,
+    WebhookError,
+    get_shipment_error,
+    parse_shipments,
+    verify_signature,
+)
 
-set_global_options(region="europe-west3", max_instances=1)
+if TYPE_CHECKING:
+    # Firestore and Pub/Sub are imported on first use, so the webhook receiver never loads Firestore
+    from google.cloud import firestore_v1, pubsub_v1
 
-initialize_app()
+REGION = "europe-west3"
+set_global_options(region=REGION, max_instances=1)
 
 API_KEY = "dummy-api-key"
 LOGISTICS_API_BASE_URL = StringParam("LOGISTICS_API_BASE_URL").value
 LOGISTICS_AUTH_API_URL = StringParam("LOGISTICS_AUTH_API_URL").value
+LOGISTICS_API_PAGE_SIZE = IntParam("LOGISTICS_API_PAGE_SIZE", default=500).value
+# "sync" runs the pipeline step by step. "async" overlaps downloads, publishing and Firestore I/O (see engine.py)
+PRODUCER_ENGINE = StringParam("PRODUCER_ENGINE", default="sync").value
+LOGISTICS_AUTH_REFRESH_WINDOW_SECONDS = IntParam("LOGISTICS_AUTH_REFRESH_WINDOW_SECONDS", default=120).value
 PROJECT_ID = os.environ.get("GCLOUD_PROJECT", "yoco-logistics-intergration")
 TOPIC_ID = "erp-order-status-update-queue"
+DEFAULT_REALM_ID = "default"
+CHECKPOINT_START = "2026-02-06T10:00:00Z"
+
+# See shards.py. "inline" polls every shard in parallel threads of the scheduled run, "tasks"
+# fans each shard out to its own Cloud Tasks invocation
+PRODUCER_SHARDS = StringParam("PRODUCER_SHARDS", default="").value
+PRODUCER_FANOUT = StringParam("PRODUCER_FANOUT", default="inline").value
+PRODUCER_MAX_PARALLEL_SHARDS = IntParam("PRODUCER_MAX_PARALLEL_SHARDS", default=8).value
+# A shard run stops taking new pages after this long. In "tasks" mode it then queues its own continuation
+SHARD_TIME_BUDGET_SECONDS = 150
+# Held on the shard's checkpoint while a run is in progress, so runs of the same shard never overlap
+SHARD_LEASE_SECONDS = 300
+SHARD_TASK_FUNCTION = "order_status_update_shard_producer"
+# Shared with the carriers that sign webhooks (see webhooks.py). Webhooks are refused while it is empty
+WEBHOOK_SECRET = StringParam("WEBHOOK_SECRET", default="").value
+# Polling is the only ingestion path until webhooks are configured. Once they are, it is only a
+# reconciliation sweep and runs less often
+POLL_SCHEDULE = "*/15 * * * *" if WEBHOOK_SECRET else "*/3 * * * *"
+# "json" or "msgpack" (see codec.py). Consumers read both, so deploy them before switching
+MESSAGE_ENCODING = StringParam("MESSAGE_ENCODING", default="json").value
+
+# Opt-in message ordering. With N > 0 buckets, messages for the same shipment share one of N
+# ordering keys (one key per shipment would send every message in its own publish request).
+# Ordering is off by default: the consumers already drop stale versions, the push subscription
+# is not ordered, and one held-back message on an ordered pull subscription stalls every shipment
+# in its bucket. Ordered publishing also sends more, smaller requests (see
+# benchmarks/publish_throughput.py)
+PUBSUB_ORDERING_KEY_BUCKETS = IntParam("PUBSUB_ORDERING_KEY_BUCKETS", default=0).value
+PUBSUB_BATCH_MAX_MESSAGES = IntParam("PUBSUB_BATCH_MAX_MESSAGES", default=1000).value
+PUBSUB_BATCH_MAX_BYTES = IntParam("PUBSUB_BATCH_MAX_BYTES", default=5 * 1024 * 1024).value
+PUBSUB_BATCH_MAX_LATENCY_MS = IntParam("PUBSUB_BATCH_MAX_LATENCY_MS", default=50).value
+PUBSUB_MAX_OUTSTANDING_MESSAGES = IntParam("PUBSUB_MAX_OUTSTANDING_MESSAGES", default=10000).value
 
+known_topics: set[str] = set()
 
-def parse_date(value) -> datetime:
-    if not isinstance(value, (str, datetime)):
-        raise TypeError('parse_date() first argument must be either type str or datetime')
-    if isinstance(value, str):
-        value = parser.parse(value)
-    if value.tzinfo is None:
-        value = value.replace(tzinfo=tzutc())
-    return value
 
+def fetch_auth_tokens(realm_ids: list[str]) -> dict[str, dict | None]:
+    """Fetches the tokens for several realms from the auth service in one call."""
+    with telemetry.span("producer.token_fetch"):
+        return request_auth_tokens(realm_ids)
+
+
+def request_auth_tokens(realm_ids: list[str]) -> dict[str, dict | None]:
+    if realm_ids == [DEFAULT_REALM_ID]:
+        # The auth service falls back to its configured realm when none is given
+        response = get_http_session().post(
+            LOGISTICS_AUTH_API_URL, headers={"Content-Type": "application/json"}, timeout=30
+        )
+        response.raise_for_status()
+        return {DEFAULT_REALM_ID: response.json().get("token")}
 
-def get_auth_token(auth_api_url: str) -> str:
-    response = requests.post(auth_api_url, headers={"Content-Type": "application/json"}, timeout=30)
+    response = get_http_session().post(
+        LOGISTICS_AUTH_API_URL,
+        json={"realm_ids": realm_ids},
+        headers={"Content-Type": "application/json"},
+        timeout=30,
+    )
     response.raise_for_status()
-    return response.json().get("token")
+    results = response.json().get("results", {})
+    return {realm_id: results.get(realm_id, {}).get("token") for realm_id in realm_ids}
 
 
-def get_last_updated(state_ref: firestore_v1.DocumentReference) -> str:
-    last_updated = parse_date("2026-02-06T10:00:00Z")
+token_cache = TokenCache(fetch_auth_tokens, LOGISTICS_AUTH_REFRESH_WINDOW_SECONDS)
+shards = load_shards(PRODUCER_SHARDS, LOGISTICS_API_BASE_URL, DEFAULT_REALM_ID)
+
+
+def get_auth_token(realm_id: str = DEFAULT_REALM_ID) -> dict:
+    """Returns the cached auth token, only calling the auth service when it is missing or about to expire."""
+    token = token_cache.get(realm_id)
+    if token is None:
+        raise requests.exceptions.RequestException(f"No auth token available for realm {realm_id}")
+    return token
+
+
+def parse_checkpoint(state_doc: firestore_v1.DocumentSnapshot) -> tuple[datetime, str | None]:
+    # claim_shard creates a new shard's document with only its lease, before any cursor is saved
+    state = state_doc.to_dict() if state_doc.exists else {}
+    if not state.get("last_updated"):
+        return parse_date(CHECKPOINT_START), None
+    return parse_date(state["last_updated"]), state.get("last_id")
+
+
+def get_checkpoint(state_ref: firestore_v1.DocumentReference) -> tuple[datetime, str | None]:
+    """Reads the (last_updated, last_id) poll cursor from the sync state document."""
+    last_updated = parse_date(CHECKPOINT_START)
     try:
-        state_doc = state_ref.get()
-        return (
-            parse_date(state_doc.get("last_updated")) if state_doc.exists else last_updated
-        )
+        return parse_checkpoint(state_ref.get())
     except Exception as e:
         print(f"Error reading state: {e}")
-        return last_updated
+        return last_updated, None
+
+
+def get_shard_lease_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=SHARD_LEASE_SECONDS)
+
+
+def is_shard_claimable(state_doc: firestore_v1.DocumentSnapshot, owner: str) -> bool:
+    if not state_doc.exists:
+        return True
+    state = state_doc.to_dict()
+    lease_expires_at = state.get("lease_expires_at")
+    return (
+        state.get("lease_owner") in (None, owner)
+        or lease_expires_at is None
+        or lease_expires_at < datetime.now(timezone.utc)
+    )
+
+
+@transactional
+def claim_shard(transaction, state_ref: firestore_v1.DocumentReference, owner: str) -> bool:
+    """Takes the shard's lease unless another run holds it. Returns whether the lease was taken."""
+    if not is_shard_claimable(state_ref.get(transaction=transaction), owner):
+        return False
+    transaction.set(state_ref, {"lease_owner": owner, "lease_expires_at": get_shard_lease_expiry()}, merge=True)
+    return True
+
+
+@transactional
+def release_shard(transaction, state_ref: firestore_v1.DocumentReference, owner: str) -> None:
+    state_doc = state_ref.get(transaction=transaction)
+    if state_doc.exists and state_doc.to_dict().get("lease_owner") == owner:
+        transaction.set(state_ref, {"lease_owner": None, "lease_expires_at": None}, merge=True)
+
+
+def get_checkpoint_update(
+    state_doc: firestore_v1.DocumentSnapshot, cursor: tuple[datetime, str], owner: str
+) -> dict | None:
+    """
+    Returns the write that moves the checkpoint forward to `cursor` and renews the lease, or
+    None if the checkpoint is already at or past it. The checkpoint never moves backwards.
+    """
+    if state_doc.exists and not is_ahead(cursor, parse_checkpoint(state_doc)):
+        return None
+    last_updated, last_id = cursor
+    update = {"last_updated": last_updated, "last_id": last_id}
+    if state_doc.exists and state_doc.to_dict().get("lease_owner") == owner:
+        update["lease_expires_at"] = get_shard_lease_expiry()
+    return update
+
+
+@transactional
+def advance_checkpoint(
+    transaction, state_ref: firestore_v1.DocumentReference, cursor: tuple[datetime, str], owner: str
+) -> bool:
+    update = get_checkpoint_update(state_ref.get(transaction=transaction), cursor, owner)
+    if update is None:
+        return False
+    transaction.set(state_ref, update, merge=True)
+    return True
+
+
+def create_publisher() -> pubsub_v1.PublisherClient:
+    """Creates a publisher with message ordering, large batches and blocking flow control."""
+    from google.cloud import pubsub_v1
+    from google.cloud.pubsub_v1.types import BatchSettings, LimitExceededBehavior, PublisherOptions, PublishFlowControl
+
+    return pubsub_v1.PublisherClient(
+        batch_settings=BatchSettings(
+            max_messages=PUBSUB_BATCH_MAX_MESSAGES,
+            max_bytes=PUBSUB_BATCH_MAX_BYTES,
+            max_latency=PUBSUB_BATCH_MAX_LATENCY_MS / 1000,
+        ),
+        publisher_options=PublisherOptions(
+            enable_message_ordering=PUBSUB_ORDERING_KEY_BUCKETS > 0,
+            flow_control=PublishFlowControl(
+                message_limit=PUBSUB_MAX_OUTSTANDING_MESSAGES,
+                limit_exceeded_behavior=LimitExceededBehavior.BLOCK,
+            ),
+        ),
+    )
+
+
+@cache
+def get_publisher() -> pubsub_v1.PublisherClient:
+    """Returns the instance-wide publisher, so its channel and batching threads are reused across runs."""
+    return create_publisher()
+
+
+def get_ordering_key(shipment_id: str) -> str:
+    if PUBSUB_ORDERING_KEY_BUCKETS <= 0:
+        return ""
+    return f"shipments-{zlib.crc32(shipment_id.encode()) % PUBSUB_ORDERING_KEY_BUCKETS}"
 
 
 def ensure_topic_exists(
     publisher: pubsub_v1.PublisherClient, project_id: str, topic_id: str
 ) -> None:
     topic_path = publisher.topic_path(project_id, topic_id)
+    if topic_path in known_topics:
+        return
+    from google.api_core.exceptions import NotFound
+
     try:
         publisher.get_topic(request={"topic": topic_path})
+        known_topics.add(topic_path)
     except NotFound:
         print(f"Topic {topic_path} not found. Creating it.")
         try:
             publisher.create_topic(request={"name": topic_path})
+            known_topics.add(topic_path)
             print(f"Topic {topic_path} created.")
         except Exception as e:
             print(f"Error creating topic: {e}")
@@ -71,88 +257,329 @@ def ensure_topic_exists(
         print(f"Error checking topic: {e}")
 
 
-def generate_shipment_messages(publisher: pubsub_v1.PublisherClient, shipments: list[dict]) -> list[Any]:
-    messages = []
-    topic = publisher.topic_path(PROJECT_ID, TOPIC_ID)
-
+def coalesce_shipments(shipments: list[dict]) -> list[tuple[dict, datetime]]:
+    """
+    Keeps only the newest version of each shipment, so every shipment ID is published once per poll.
+    Returns (shipment, last_updated) pairs ordered by the position of each newest version.
+    """
+    latest = {}
     for shipment in shipments:
         shipment_id = shipment.get("id")
+        if not shipment_id or not shipment.get("last_updated"):
+            telemetry.log("Skipping invalid shipment data", severity="WARNING", shipment_id=shipment_id)
+            telemetry.count("producer.shipments", outcome="invalid")
+            continue
+
         last_updated = parse_date(shipment.get("last_updated"))
+        current = latest.get(shipment_id)
+        if current is not None:
+            telemetry.count("producer.shipments", outcome="coalesced")
+            if current[1] > last_updated:
+                continue
+        # Re-insert so the shipment takes the position of its newest version
+        latest.pop(shipment_id, None)
+        latest[shipment_id] = (shipment, last_updated)
 
-        if not shipment_id or not last_updated:
-            print(f"Skipping invalid shipment data: {shipment}")
-            continue
+    return list(latest.values())
 
+
+def generate_shipment_messages(publisher: pubsub_v1.PublisherClient, shipments: list[dict]) -> list[Any]:
+    messages = []
+    topic = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+
+    for shipment, last_updated in coalesce_shipments(shipments):
+        shipment_id = shipment.get("id")
+        data, attributes = encode_shipment(shipment, MESSAGE_ENCODING)
         message = publisher.publish(
             topic,
-            json.dumps(shipment).encode("utf-8"),
+            data,
+            ordering_key=get_ordering_key(shipment_id),
             shipment_id=shipment_id,
             updated_at=datetime.now(timezone.utc).isoformat(),
+            **attributes,
         )
-        messages.append((message, last_updated))
+        messages.append((message, last_updated, shipment_id))
 
     return messages
 
 
-def poll_shipment_updates_api(last_updated: datetime) -> list[dict]:
+def get_auth_headers(token: dict) -> dict:
+    return {
+        "Authorization": f"{token['token_type'].capitalize()} {token['access_token']}",
+        "Content-Type": "application/json",
+    }
+
+
+def get_poll_params(last_updated: datetime, last_id: str | None) -> dict:
+    params = {"last_updated": last_updated.isoformat(), "limit": LOGISTICS_API_PAGE_SIZE}
+    if last_id:
+        params["last_id"] = last_id
+    return params
+
+
+def sort_page(shipments: list) -> list[dict]:
+    """
+    Drops rows that fail the webhook checks (a string id and a valid last_updated), so one bad row
+    cannot fail the page and hold the checkpoint back, then sorts the rest.
+    """
+    valid = []
+    for shipment in shipments:
+        error = get_shipment_error(shipment)
+        if error is None:
+            valid.append(shipment)
+            continue
+        shipment_id = shipment.get("id") if isinstance(shipment, dict) else None
+        telemetry.log("Skipping invalid shipment data", severity="WARNING", shipment_id=shipment_id, error=error)
+        telemetry.count("producer.shipments", outcome="invalid")
+    # The api should return pages sorted by (last_updated, id). But lets not trust it within a page
+    valid.sort(key=lambda x: (parse_date(x["last_updated"]), x["id"]))
+    return valid
+
+
+def poll_shipment_updates_api(
+    shard: Shard, last_updated: datetime, last_id: str | None = None
+) -> Iterator[list[dict]]:
+    """
+    Yields pages of shipments updated after the (last_updated, last_id) cursor, oldest first.
+    Only one page is held in memory at a time, so the backlog size does not matter.
+    """
     try:
-        params = {"last_updated": last_updated.isoformat()}
-        token = get_auth_token(LOGISTICS_AUTH_API_URL)
-        response = requests.get(
-            LOGISTICS_API_BASE_URL,
-            params=params,
-            headers={
-                "Authorization": f"{token['token_type'].capitalize} {token['access_token']}",
-                "Content-Type": "application/json",
-            },
-            timeout=30,
-        )
-        response.raise_for_status()
-        shipments: list = response.json().get("data", [])
+        headers = get_auth_headers(get_auth_token(shard.realm_id))
+        while True:
+            params = get_poll_params(last_updated, last_id)
+            with telemetry.span("producer.page_fetch"):
+                response = get_http_session().get(shard.base_url, params=params, headers=headers, timeout=30)
+            if response.status_code == 401:
+                # Token revoked upstream before its expiry. Drop it so the next run fetches a new one
+                token_cache.invalidate(shard.realm_id)
+            response.raise_for_status()
+            body = response.json()
+            shipments: list = body.get("data", [])
+            if not shipments:
+                return
+
+            yield sort_page(shipments)
 
-        # Ideally the api should return these shipments sorted. But lets assume not
-        shipments.sort(key=lambda x: parse_date(x.get("last_updated")))
-        return shipments
+            next_cursor = body.get("next_cursor")
+            if not next_cursor:
+                return
+            last_updated, last_id = parse_date(next_cursor["last_updated"]), next_cursor["id"]
     except requests.exceptions.RequestException as e:
         print(f"API Request failed: {e}")
-        return []
 
 
-@scheduler_fn.on_schedule(schedule="*/3 * * * *", max_instances=1)
+class PublishError(Exception):
+    """Raised when a page is only partially published. Carries the cursor of the last published message."""
+
+    def __init__(self, cursor: tuple[datetime, str] | None):
+        super().__init__("Page partially published")
+        self.cursor = cursor
+
+
+def resume_publishing(publisher: pubsub_v1.PublisherClient) -> None:
+    """A failed ordered publish pauses its key. Resume them all so the next run can publish again."""
+    topic = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+    for bucket in range(PUBSUB_ORDERING_KEY_BUCKETS):
+        publisher.resume_publish(topic, f"shipments-{bucket}")
+
+
+def publish_page(publisher: pubsub_v1.PublisherClient, shipments: list[dict]) -> tuple[datetime, str] | None:
+    """
+    Publishes a page of shipments and waits for the results. Returns the cursor of the last
+    message published in order, or None if nothing was published.
+    """
+    cursor = None
+    with telemetry.span("producer.publish_page"):
+        messages = generate_shipment_messages(publisher, shipments)
+        for index, (message, message_last_updated, shipment_id) in enumerate(messages):
+            try:
+                message.result()
+            except Exception as e:
+                print(f"Error publishing to Pub/Sub: {e}")
+                telemetry.count("producer.shipments", len(messages) - index, outcome="failed")
+                resume_publishing(publisher)
+                raise PublishError(cursor) from e
+            cursor = (message_last_updated, shipment_id)
+            telemetry.count("producer.shipments", outcome="published")
+    return cursor
+
+
+def save_checkpoint(state_ref: firestore_v1.DocumentReference, cursor: tuple[datetime, str], owner: str) -> None:
+    last_updated, last_id = cursor
+    with telemetry.span("producer.save_checkpoint"):
+        advanced = advance_checkpoint(get_firestore_client().transaction(), state_ref, cursor, owner)
+    if advanced:
+        print(f"Checkpoint updated to: {last_updated} ({last_id})")
+    else:
+        print(f"Checkpoint already past {last_updated} ({last_id})")
+
+
+def poll_shard(
+    shard: Shard, state_ref: firestore_v1.DocumentReference, owner: str, deadline: float
+) -> tuple[int, bool]:
+    """
+    Publishes the shard's updates page by page, moving its checkpoint forward after each page.
+    Returns the number of shipments published and whether pages were left when the deadline passed.
+    """
+    last_updated, last_id = get_checkpoint(state_ref)
+
+    print(f"Polling shard {shard.id} for updates since: {last_updated} ({last_id})")
+    publisher = None
+    published = 0
+    for page in poll_shipment_updates_api(shard, last_updated, last_id):
+        print(f"Found {len(page)} updates.")
+        if publisher is None:
+            publisher = get_publisher()
+            ensure_topic_exists(publisher, PROJECT_ID, TOPIC_ID)
+
+        try:
+            cursor = publish_page(publisher, page)
+        except PublishError as e:
+            # Keep what was published in order and let the next run pick up from there
+            if e.cursor:
+                save_checkpoint(state_ref, e.cursor, owner)
+            break
+
+        if cursor:
+            save_checkpoint(state_ref, cursor, owner)
+            published += len(page)
+        if time.monotonic() >= deadline:
+            return published, True
+
+    return published, False
+
+
+def run_shard(shard: Shard, deadline: float) -> tuple[int, bool]:
+    """
+    Runs one producer pass for a shard while holding its lease. Returns the number of shipments
+    published and whether the shard still has a backlog.
+    """
+    db = get_firestore_client()
+    state_ref = db.collection("system-state").document(shard.checkpoint_id)
+    owner = uuid.uuid4().hex
+    if not claim_shard(db.transaction(), state_ref, owner):
+        print(f"Shard {shard.id} is being polled by another run. Skipping.")
+        return 0, False
+
+    try:
+        if PRODUCER_ENGINE == "async":
+            from engine import run_producer
+
+            result = asyncio.run(run_producer(shard, state_ref.id, owner, deadline))
+        else:
+            result = poll_shard(shard, state_ref, owner, deadline)
+    finally:
+        release_shard(db.transaction(), state_ref, owner)
+    telemetry.count("producer.shard_runs", shard=shard.id, backlog=result[1])
+    return result
+
+
+def enqueue_shard(shard_id: str) -> None:
+    from firebase_admin import functions as admin_functions
+
+    queue = admin_functions.task_queue(f"locations/{REGION}/functions/{SHARD_TASK_FUNCTION}", app=get_firebase_app())
+    queue.enqueue({"shard_id": shard_id})
+
+
+@scheduler_fn.on_schedule(schedule=POLL_SCHEDULE, max_instances=1, timeout_sec=300)
+@telemetry.first_invocation
 def order_status_update_producer(event: scheduler_fn.ScheduledEvent) -> None:
     """
-    Polls the Logistics API for shipment updates and publishes them to Pub/Sub.
+    Polls the Logistics API shards for shipment updates and publishes them to Pub/Sub.
+    With PRODUCER_FANOUT "tasks" it only queues one task per shard, otherwise it polls every
+    shard itself in parallel. With webhooks configured, updates normally arrive through
+    receive_shipment_updates and this is a reconciliation sweep for anything a webhook missed.
     """
     print(f"Producer triggered by cron: {event}")
+    if PRODUCER_FANOUT == "tasks":
+        for shard_id in shards:
+            enqueue_shard(shard_id)
+        print(f"Queued {len(shards)} shards.")
+        return
 
-    db = firestore_v1.Client()
-    state_ref = db.collection("system-state").document("erp-order-status-sync")
-    last_updated = get_last_updated(state_ref)
+    try:
+        # One batched call to the auth service for every realm, rather than one per shard
+        token_cache.get_many(sorted({shard.realm_id for shard in shards.values()}))
+    except requests.exceptions.RequestException as e:
+        print(f"API Request failed: {e}")
 
-    print(f"Polling API for updates since: {last_updated}")
-    shipments = poll_shipment_updates_api(last_updated)
-    if not shipments:
-        print("No new shipments found.")
+    deadline = time.monotonic() + SHARD_TIME_BUDGET_SECONDS
+    if len(shards) == 1:
+        results = [run_shard(shard, deadline) for shard in shards.values()]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(shards), PRODUCER_MAX_PARALLEL_SHARDS)) as executor:
+            results = list(executor.map(lambda shard: run_shard(shard, deadline), shards.values()))
+    report_published(sum(published for published, _ in results))
+
+
+@tasks_fn.on_task_dispatched(
+    retry_config=RetryConfig(max_attempts=3, min_backoff_seconds=10),
+    rate_limits=RateLimits(max_concurrent_dispatches=PRODUCER_MAX_PARALLEL_SHARDS),
+    max_instances=PRODUCER_MAX_PARALLEL_SHARDS,
+    timeout_sec=300,
+)
+@telemetry.first_invocation
+def order_status_update_shard_producer(request: tasks_fn.CallableRequest) -> None:
+    """Polls one shard. Queues the shard again straight away if its backlog did not fit in one run."""
+    shard = shards.get(request.data.get("shard_id"))
+    if shard is None:
+        print(f"Unknown shard {request.data.get('shard_id')}. Skipping.")
         return
 
-    print(f"Found {len(shipments)} updates.")
-    publisher = pubsub_v1.PublisherClient()
-    ensure_topic_exists(publisher, PROJECT_ID, TOPIC_ID)
-    messages = generate_shipment_messages(publisher, shipments)
+    published, backlog = run_shard(shard, time.monotonic() + SHARD_TIME_BUDGET_SECONDS)
+    if backlog:
+        enqueue_shard(shard.id)
+    report_published(published)
+
 
-    max_timestamp_seen = last_updated
+def webhook_response(status: int, body: dict) -> https_fn.Response:
+    return https_fn.Response(status=status, response=json.dumps(body), content_type="application/json")
+
+
+@https_fn.on_request(max_instances=10)
+@telemetry.first_invocation
+def receive_shipment_updates(request: https_fn.Request) -> https_fn.Response:
+    """
+    Accepts signed shipment-update webhooks and publishes them to Pub/Sub in the same format as
+    the poller. Answers 202 once every update is published, so a carrier can retry on anything else.
+    """
+    if request.method != "POST":
+        return webhook_response(405, {"error": "Method not allowed"})
+    if not WEBHOOK_SECRET:
+        return webhook_response(503, {"error": "Webhooks are not configured"})
+
+    body = request.get_data()
     try:
-        for message, message_last_updated in messages:
-            message.result()
-            if message_last_updated > max_timestamp_seen:
-                max_timestamp_seen = message_last_updated
-        print(f"Successfully published {len(messages)} messages.")
-    except Exception as e:
-        print(f"Error publishing to Pub/Sub: {e}")
-        # Continue and allow updating of state.last_updated
+        verify_signature(
+            WEBHOOK_SECRET.encode(), request.headers.get(TIMESTAMP_HEADER), request.headers.get(SIGNATURE_HEADER), body
+        )
+        shipments = parse_shipments(body)
+    except WebhookError as e:
+        telemetry.count("producer.webhooks", outcome="rejected", status=e.status)
+        return webhook_response(e.status, {"error": str(e)})
 
-    if max_timestamp_seen > last_updated:
-        state_ref.set({"last_updated": max_timestamp_seen}, merge=True)
-        print(f"Checkpoint updated to: {max_timestamp_seen}")
+    publisher = get_publisher()
+    ensure_topic_exists(publisher, PROJECT_ID, TOPIC_ID)
+    try:
+        publish_page(publisher, sort_page(shipments))
+    except PublishError:
+        telemetry.count("producer.webhooks", outcome="failed")
+        telemetry.flush()
+        return webhook_response(503, {"error": "Publishing failed"})
+
+    telemetry.count("producer.webhooks", outcome="published")
+    telemetry.flush()
+    return webhook_response(202, {"accepted": len(shipments)})
+
+
+def report_published(published: int) -> None:
+    if not published:
+        print("No new shipments found.")
+    else:
+        print(f"Successfully published {published} messages.")
 
     print("Producer run completed.")
+    telemetry.flush()
+
+
+telemetry.record_import("producer")
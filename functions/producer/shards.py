@@ -0,0 +1,49 @@
+"""
+Producer shards. A shard polls one carrier's Logistics API with one realm's credentials and keeps
+its own checkpoint document, so shards run in parallel without sharing a cursor.
+
+Shards are configured with PRODUCER_SHARDS, a JSON list such as
+    [{"id": "acme-za", "base_url": "https://...", "realm_id": "123189227149329"}]
+`base_url` and `realm_id` fall back to LOGISTICS_API_BASE_URL and the auth service's default realm.
+Without PRODUCER_SHARDS there is a single shard, which keeps the original checkpoint document.
+"""
+import json
+from dataclasses import dataclass
+from datetime import datetime
+
+DEFAULT_SHARD_ID = "default"
+CHECKPOINT_DOCUMENT_ID = "erp-order-status-sync"
+
+
+@dataclass(frozen=True)
+class Shard:
+    id: str
+    base_url: str
+    realm_id: str
+
+    @property
+    def checkpoint_id(self) -> str:
+        if self.id == DEFAULT_SHARD_ID:
+            return CHECKPOINT_DOCUMENT_ID
+        return f"{CHECKPOINT_DOCUMENT_ID}-{self.id}"
+
+
+def load_shards(config: str, default_base_url: str, default_realm_id: str) -> dict[str, Shard]:
+    """Parses the PRODUCER_SHARDS config into shards keyed by ID."""
+    if not config:
+        return {DEFAULT_SHARD_ID: Shard(DEFAULT_SHARD_ID, default_base_url, default_realm_id)}
+
+    shards = {}
+    for item in json.loads(config):
+        shard = Shard(
+            str(item["id"]), item.get("base_url") or default_base_url, str(item.get("realm_id") or default_realm_id)
+        )
+        if shard.id in shards:
+            raise ValueError(f"Duplicate producer shard {shard.id}")
+        shards[shard.id] = shard
+    return shards
+
+
+def is_ahead(cursor: tuple[datetime, str], current: tuple[datetime, str | None]) -> bool:
+    """Whether `cursor` is past the `current` checkpoint in (last_updated, id) order."""
+    return (cursor[0], cursor[1]) > (current[0], current[1] or "")
@@ -0,0 +1,115 @@
+import threading
+import time
+from contextlib import ExitStack
+from typing import Callable
+
+import telemetry
+
+
+def token_expires_at(token: dict, time_type: str = "expires_in") -> int:
+    """Returns the epoch time in milliseconds at which the token expires."""
+    return token.get("createdAt") + token.get(time_type) * 1000
+
+
+class TokenCache:
+    """
+    Process-wide cache of auth tokens keyed by realm ID.
+
+    Tokens are served from memory until they expire. Inside the refresh window before expiry
+    the cached token is still served while a single background thread fetches a new one.
+    Expired or missing tokens are fetched inline, with one fetch per realm at a time.
+    `fetch` takes a list of realm IDs and returns a token (or None) for each, so misses for
+    several realms are fetched together.
+    """
+
+    def __init__(self, fetch: Callable[[list[str]], dict[str, dict | None]], refresh_window_seconds: int = 300):
+        self._fetch = fetch
+        self._refresh_window_ms = refresh_window_seconds * 1000
+        self._tokens: dict[str, dict] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._refreshing: set[str] = set()
+        self._guard = threading.Lock()
+
+    def get(self, realm_id: str) -> dict | None:
+        return self.get_many([realm_id])[realm_id]
+
+    def get_many(self, realm_ids: list[str]) -> dict[str, dict | None]:
+        tokens = {}
+        missing = []
+        for realm_id in dict.fromkeys(realm_ids):
+            token = self._cached(realm_id)
+            if token is None:
+                missing.append(realm_id)
+            else:
+                tokens[realm_id] = token
+        telemetry.count("token_cache.lookups", len(tokens), result="hit")
+        telemetry.count("token_cache.lookups", len(missing), result="miss")
+
+        if missing:
+            # Locks are always taken in sorted order so overlapping batches cannot deadlock
+            with ExitStack() as stack:
+                for realm_id in sorted(missing):
+                    stack.enter_context(self._lock_for(realm_id))
+                # Another caller may have refreshed some tokens while we waited for the locks
+                now = round(time.time() * 1000)
+                stale = []
+                for realm_id in missing:
+                    token = self._tokens.get(realm_id)
+                    if token is not None and token_expires_at(token) > now:
+                        tokens[realm_id] = token
+                    else:
+                        stale.append(realm_id)
+                if stale:
+                    tokens.update(self._refresh(stale))
+        return tokens
+
+    def put(self, realm_id: str, token: dict) -> None:
+        self._tokens[realm_id] = token
+
+    def invalidate(self, realm_id: str) -> None:
+        self._tokens.pop(realm_id, None)
+
+    def _cached(self, realm_id: str) -> dict | None:
+        token = self._tokens.get(realm_id)
+        if token is None:
+            return None
+        remaining_ms = token_expires_at(token) - round(time.time() * 1000)
+        if remaining_ms <= 0:
+            return None
+        if remaining_ms <= self._refresh_window_ms:
+            self._refresh_in_background(realm_id)
+        return token
+
+    def _lock_for(self, realm_id: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(realm_id, threading.Lock())
+
+    def _refresh(self, realm_ids: list[str]) -> dict[str, dict | None]:
+        fetched = self._fetch(realm_ids)
+        tokens = {}
+        for realm_id in realm_ids:
+            token = fetched.get(realm_id)
+            if token is None:
+                self.invalidate(realm_id)
+            else:
+                self.put(realm_id, token)
+            tokens[realm_id] = token
+        return tokens
+
+    def _refresh_in_background(self, realm_id: str) -> None:
+        with self._guard:
+            if realm_id in self._refreshing:
+                return
+            self._refreshing.add(realm_id)
+
+        def run():
+            try:
+                with self._lock_for(realm_id):
+                    self._refresh([realm_id])
+            except Exception as e:
+                print(f"Background token refresh failed for realm {realm_id}: {e}")
+            finally:
+                with self._guard:
+                    self._refreshing.discard(realm_id)
+
+        threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,85 @@
+"""
+Signed shipment-update webhooks.
+
+A webhook carries one shipment update as its JSON body, or several as a list or under "shipments".
+It is signed with an HMAC-SHA256 over "{timestamp}.{body}" keyed with WEBHOOK_SECRET:
+    X-Webhook-Timestamp: 1767225600
+    X-Webhook-Signature: sha256=<hex digest>
+Requests whose timestamp is more than MAX_CLOCK_SKEW_SECONDS away are rejected, so a captured
+request cannot be replayed later.
+"""
+import hashlib
+import hmac
+import json
+import time
+
+from dates import parse_date
+
+SIGNATURE_HEADER = "X-Webhook-Signature"
+TIMESTAMP_HEADER = "X-Webhook-Timestamp"
+SIGNATURE_PREFIX = "sha256="
+MAX_CLOCK_SKEW_SECONDS = 300
+MAX_WEBHOOK_SHIPMENTS = 1000
+
+
+class WebhookError(Exception):
+    """Raised for a webhook that is rejected. Carries the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+def sign(secret: bytes, timestamp: str, body: bytes) -> str:
+    digest = hmac.new(secret, timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+    return f"{SIGNATURE_PREFIX}{digest}"
+
+
+def verify_signature(secret: bytes, timestamp: str | None, signature: str | None, body: bytes) -> None:
+    if not timestamp or not signature:
+        raise WebhookError("Missing signature", 401)
+    try:
+        skew = abs(time.time() - int(timestamp))
+    except ValueError:
+        raise WebhookError("Invalid timestamp", 401)
+    if skew > MAX_CLOCK_SKEW_SECONDS:
+        raise WebhookError("Timestamp outside the allowed window", 401)
+    if not hmac.compare_digest(sign(secret, timestamp, body), signature):
+        raise WebhookError("Invalid signature", 401)
+
+
+def get_shipment_error(shipment) -> str | None:
+    """Returns why a shipment update cannot be published, or None if it is well formed."""
+    if not isinstance(shipment, dict) or not shipment.get("id"):
+        return "has no id"
+    # Ids become ordering keys and message attributes, which must be strings
+    if not isinstance(shipment["id"], str):
+        return "id must be a string"
+    try:
+        parse_date(shipment.get("last_updated"))
+    except (TypeError, ValueError):
+        return "has no valid last_updated"
+    return None
+
+
+def parse_shipments(body: bytes) -> list[dict]:
+    """Returns the shipment updates in a webhook body, checking each has an id and a valid last_updated."""
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise WebhookError("Body is not JSON", 400)
+
+    if isinstance(payload, dict):
+        shipments = payload.get("shipments", [payload])
+    else:
+        shipments = payload
+    if not isinstance(shipments, list) or not shipments:
+        raise WebhookError("No shipments", 400)
+    if len(shipments) > MAX_WEBHOOK_SHIPMENTS:
+        raise WebhookError(f"At most {MAX_WEBHOOK_SHIPMENTS} shipments per webhook", 400)
+
+    for index, shipment in enumerate(shipments):
+        error = get_shipment_error(shipment)
+        if error is not None:
+            raise WebhookError(f"Shipment {index} {error}", 400)
+    return shipments